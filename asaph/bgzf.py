@@ -0,0 +1,259 @@
+"""
+This module provides support for BGZF (blocked gzip) compressed VCF files, including
+reading and writing BGZF blocks and building a local index of block offsets so that
+variants from a genomic region can be read without decompressing the whole file.
+
+Copyright 2015 Ronald J. Nowling
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from collections import namedtuple
+import gzip
+import os
+import struct
+import zlib
+
+INDEX_SUFFIX = ".asaph_idx"
+
+# gzip header with the BC extra subfield used by BGZF
+BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+BGZF_HEADER_SIZE = 18
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+# BGZF blocks can hold at most 64 KB.  Leave room for incompressible data.
+MAX_BLOCK_INPUT_SIZE = 0xff00
+
+# An index entry points to the start of a variant line.  coffset is the
+# file offset of the BGZF block in which the line starts and uoffset is
+# the offset of the line within the decompressed block.
+IndexEntry = namedtuple("IndexEntry",
+                        ["chrom",
+                         "pos",
+                         "coffset",
+                         "uoffset"])
+
+def is_bgzf(flname):
+    """
+    Checks whether a file starts with a BGZF block header.
+    """
+    with open(flname, "rb") as fl:
+        header = fl.read(BGZF_HEADER_SIZE)
+
+    return len(header) == BGZF_HEADER_SIZE and \
+        header[:4] == BGZF_MAGIC and \
+        header[12:14] == b"BC"
+
+def iter_bgzf_blocks(flname):
+    """
+    Yields (coffset, data) pairs of the file offset and decompressed
+    contents of each BGZF block.
+    """
+    with open(flname, "rb") as fl:
+        while True:
+            coffset = fl.tell()
+            header = fl.read(BGZF_HEADER_SIZE)
+            if len(header) == 0:
+                break
+
+            if len(header) < BGZF_HEADER_SIZE or header[:4] != BGZF_MAGIC:
+                raise Exception("File '%s' is not BGZF compressed." % flname)
+
+            # BSIZE is the total block size minus 1
+            block_size = struct.unpack("<H", header[16:18])[0] + 1
+            payload = fl.read(block_size - BGZF_HEADER_SIZE)
+
+            # drop the CRC32 and ISIZE trailer
+            data = zlib.decompress(payload[:-8], -15)
+            if len(data) > 0:
+                yield coffset, data
+
+def _compress_block(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+
+    block_size = BGZF_HEADER_SIZE + len(compressed) + 8
+    header = BGZF_MAGIC + b"\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00" + \
+        struct.pack("<H", block_size - 1)
+    trailer = struct.pack("<II", zlib.crc32(data), len(data))
+
+    return header + compressed + trailer
+
+class BGZFWriter:
+    """
+    Writes text to a BGZF compressed file.  The output is a valid
+    gzip file that can also be read with gzip.open().
+    """
+    def __init__(self, flname):
+        self.fl = open(flname, "wb")
+        self.buffer = bytearray()
+
+    def write(self, text):
+        self.buffer.extend(text.encode("utf-8"))
+        while len(self.buffer) >= MAX_BLOCK_INPUT_SIZE:
+            self.fl.write(_compress_block(bytes(self.buffer[:MAX_BLOCK_INPUT_SIZE])))
+            del self.buffer[:MAX_BLOCK_INPUT_SIZE]
+
+    def close(self):
+        if len(self.buffer) > 0:
+            self.fl.write(_compress_block(bytes(self.buffer)))
+            self.buffer = bytearray()
+        self.fl.write(BGZF_EOF)
+        self.fl.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def _line_label(ln):
+    cols = ln.split(maxsplit=2)
+    return cols[0].decode("utf-8"), int(cols[1])
+
+def build_index(flname):
+    """
+    Scans a BGZF compressed VCF file and returns a list of IndexEntry
+    for the first variant line starting in each block and for each line
+    where the chromosome changes.
+    """
+    entries = []
+    last_chrom = None
+    last_entry_coffset = None
+
+    # partial line carried over from the previous block(s)
+    carry = b""
+    carry_offset = None
+
+    for coffset, data in iter_bgzf_blocks(flname):
+        start = 0
+        if len(carry) > 0:
+            newline = data.find(b"\n")
+            if newline == -1:
+                carry += data
+                continue
+
+            ln = carry + data[:newline + 1]
+            if not ln.startswith(b"#"):
+                chrom, pos = _line_label(ln)
+                if chrom != last_chrom or carry_offset[0] != last_entry_coffset:
+                    entries.append(IndexEntry(chrom, pos, *carry_offset))
+                    last_chrom = chrom
+                    last_entry_coffset = carry_offset[0]
+            start = newline + 1
+            carry = b""
+
+        # complete lines that start in this block
+        end = data.rfind(b"\n") + 1
+        line_start = start
+        while line_start < end:
+            line_end = data.index(b"\n", line_start) + 1
+            ln = data[line_start:line_end]
+            if not ln.startswith(b"#") and ln.strip():
+                chrom, pos = _line_label(ln)
+                if coffset != last_entry_coffset or chrom != last_chrom:
+                    entries.append(IndexEntry(chrom, pos, coffset, line_start))
+                    last_chrom = chrom
+                    last_entry_coffset = coffset
+
+                    # chromosomes are contiguous, so if the last line in
+                    # the block has the same chromosome, no other entries
+                    # are needed for this block
+                    last_ln = data[data.rfind(b"\n", 0, end - 1) + 1:end]
+                    if not last_ln.startswith(b"#") and \
+                       _line_label(last_ln)[0] == chrom:
+                        break
+            line_start = line_end
+
+        if end < len(data):
+            carry = data[end:]
+            carry_offset = (coffset, end)
+
+    return entries
+
+def write_index(flname, entries):
+    with open(flname, "wt", encoding="utf-8") as fl:
+        for entry in entries:
+            fl.write("\t".join(map(str, entry)))
+            fl.write("\n")
+
+def read_index(flname):
+    entries = []
+    with open(flname, "rt", encoding="utf-8") as fl:
+        for ln in fl:
+            chrom, pos, coffset, uoffset = ln.rstrip("\n").split("\t")
+            entries.append(IndexEntry(chrom, int(pos), int(coffset), int(uoffset)))
+
+    return entries
+
+def load_index(vcf_flname):
+    """
+    Reads the index stored next to the VCF file, building it first
+    if it does not exist or is older than the VCF file.  If the index
+    cannot be saved (e.g., the directory is read-only), the index is
+    only kept in memory.
+    """
+    index_flname = vcf_flname + INDEX_SUFFIX
+    if not os.path.exists(index_flname) or \
+       os.path.getmtime(index_flname) < os.path.getmtime(vcf_flname):
+        print("Building BGZF index", index_flname)
+        entries = build_index(vcf_flname)
+        try:
+            write_index(index_flname, entries)
+        except OSError as e:
+            print("Could not save BGZF index, using it in memory:", e)
+        return entries
+
+    return read_index(index_flname)
+
+def read_lines_from(flname, coffset, uoffset):
+    """
+    Yields the lines of a BGZF file starting at the given virtual offset.
+    """
+    with open(flname, "rb") as raw:
+        raw.seek(coffset)
+        with gzip.GzipFile(fileobj=raw, mode="rb") as fl:
+            fl.read(uoffset)
+            yield from fl
+
+def fetch_region(flname, entries, chrom, start, end):
+    """
+    Yields the variant lines of a sorted BGZF compressed VCF file on the
+    given chromosome with start <= position <= end.  Reading begins at the
+    last indexed line before the region, so only the blocks overlapping the
+    region are decompressed.
+    """
+    chrom_entries = [entry for entry in entries if entry.chrom == chrom]
+    if len(chrom_entries) == 0:
+        return
+
+    # the same position can appear on several lines, so start
+    # from the last indexed line strictly before the region
+    first = chrom_entries[0]
+    for entry in chrom_entries:
+        if entry.pos >= start:
+            break
+        first = entry
+
+    chrom_bytes = chrom.encode("utf-8")
+    for ln in read_lines_from(flname, first.coffset, first.uoffset):
+        cols = ln.split(maxsplit=2)
+        if cols[0] != chrom_bytes:
+            break
+
+        pos = int(cols[1])
+        if pos > end:
+            break
+
+        if pos >= start:
+            yield ln
@@ -19,45 +19,72 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import numpy as np
+
+from .models import FeatureBlock
+
+# counts and indicators are at most 2, so one byte per value
+# is enough.  Conversion to floating point is left to the
+# consumers of the feature matrix.
+FEATURE_DTYPE = np.uint8
+
 class CountFeaturesExtractor:
+    """
+    Converts a stream of VariantBlocks into FeatureBlocks with
+    ref and alt allele count columns for each variant.
+    """
     def __init__(self, stream):
         self.stream = stream
 
     def __iter__(self):
-        for variant_label, alleles, genotypes in self.stream:
-            chrom, pos = variant_label
-            ref_column = [0.] * len(genotypes)
-            alt_column = [0.] * len(genotypes)
-
-            for row_idx, (_, allele_counts) in enumerate(genotypes):
-                ref_column[row_idx] = allele_counts[0]
-                alt_column[row_idx] = allele_counts[1]
-
-            yield (chrom, pos, alleles[0]), tuple(ref_column)
-            yield (chrom, pos, alleles[1]), tuple(alt_column)
+        for block in self.stream:
+            labels = []
+            for chrom, pos, ref, alt in zip(block.chromosomes,
+                                            block.positions,
+                                            block.ref_alleles,
+                                            block.alt_alleles):
+                labels.append((chrom, pos, ref))
+                labels.append((chrom, pos, alt))
+
+            # (n_variants, n_samples, 2) -> (n_samples, n_variants * 2)
+            # so that the ref and alt columns of each variant are adjacent
+            n_variants, n_samples, _ = block.genotypes.shape
+            columns = block.genotypes.transpose(1, 0, 2) \
+                                     .reshape(n_samples, 2 * n_variants) \
+                                     .astype(FEATURE_DTYPE)
+
+            yield FeatureBlock(labels, columns)
 
 class CategoricalFeaturesExtractor:
+    """
+    Converts a stream of VariantBlocks into FeatureBlocks with
+    homozygous ref, homozygous alt, and heterozygous indicator
+    columns for each variant.
+    """
     def __init__(self, stream):
         self.stream = stream
 
     def __iter__(self):
-        for variant_label, alleles, genotypes in self.stream:
-            chrom, pos = variant_label
-            homo1_column = [0.] * len(genotypes)
-            homo2_column = [0.] * len(genotypes)
-            het_column = [0.] * len(genotypes)
-
-            for row_idx, (_, allele_counts) in enumerate(genotypes):
-                if allele_counts == (2, 0):
-                    homo1_column[row_idx] = 1
-                elif allele_counts == (0, 2):
-                    homo2_column[row_idx] = 1
-                elif allele_counts == (1, 1):
-                    het_column[row_idx] = 1
-
-            yield (chrom, pos, (alleles[0] + "/" + alleles[0])), tuple(homo1_column)
-            yield (chrom, pos, (alleles[1] + "/" + alleles[1])), tuple(homo2_column)
-            yield (chrom, pos, (alleles[0] + "/" + alleles[1])), tuple(het_column)
+        for block in self.stream:
+            labels = []
+            for chrom, pos, ref, alt in zip(block.chromosomes,
+                                            block.positions,
+                                            block.ref_alleles,
+                                            block.alt_alleles):
+                labels.append((chrom, pos, (ref + "/" + ref)))
+                labels.append((chrom, pos, (alt + "/" + alt)))
+                labels.append((chrom, pos, (ref + "/" + alt)))
+
+            ref_counts = block.genotypes[:, :, 0].T
+            alt_counts = block.genotypes[:, :, 1].T
+            n_samples, n_variants = ref_counts.shape
+
+            columns = np.zeros((n_samples, n_variants, 3), dtype=FEATURE_DTYPE)
+            columns[:, :, 0] = (ref_counts == 2) & (alt_counts == 0)
+            columns[:, :, 1] = (ref_counts == 0) & (alt_counts == 2)
+            columns[:, :, 2] = (ref_counts == 1) & (alt_counts == 1)
+
+            yield FeatureBlock(labels, columns.reshape(n_samples, 3 * n_variants))
 
 class FeatureStringsExtractor:
     def __init__(self, stream):
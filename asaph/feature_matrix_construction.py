@@ -18,14 +18,22 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+from collections import deque
 import heapq
+import math
+import multiprocessing
 import random
 
 import mmh3
 
 import numpy as np
+from scipy.sparse import csc_matrix
+from scipy.sparse import csr_matrix
 
 from .feature_extraction import *
+from .models import FeatureIndex
+from .vcf import decode_genotype_block
+from .vcf import filter_invariant_blocks
 
 COUNTS_FEATURE_TYPE = "allele-counts"
 CATEGORIES_FEATURE_TYPE = "genotype-categories"
@@ -34,124 +42,617 @@ RESERVOIR_SAMPLING = "reservoir"
 FEATURE_HASHING = "feature-hashing"
 BOTTOMK_SKETCHING = "bottom-k"
 
+# seed passed to mmh3.hash for feature hashing and bottom-k sketching
+DEFAULT_HASH_SEED = 0
+
+def feature_name(label):
+    chrom, pos, gt = label
+    return "{}_{}_{}".format(chrom, pos, gt)
+
+def feature_keys(labels):
+    """
+    Unique names for the features of a block.  Variants with identical
+    ref and alt alleles produce repeated labels, so repeats of a label
+    get an occurrence suffix.
+    """
+    keys = []
+    previous = None
+    occurrence = 0
+    for label in labels:
+        if label == previous:
+            occurrence += 1
+        else:
+            occurrence = 0
+        previous = label
+
+        key = feature_name(label)
+        if occurrence > 0:
+            key = "{}_{}".format(key, occurrence)
+        keys.append(key)
+
+    return keys
+
+def keyed_feature_index(entries, hash_seed=DEFAULT_HASH_SEED, random_seed=None, hashes=None, sketch_size=None):
+    """
+    Creates the FeatureIndex for explicitly kept features from a list
+    of (key, chromosome, position) entries in column order.
+    """
+    return FeatureIndex(keys=[key for key, _, _ in entries],
+                        chromosomes=[chrom for _, chrom, _ in entries],
+                        positions=np.array([pos for _, _, pos in entries], dtype=np.int64),
+                        buckets=None,
+                        n_buckets=None,
+                        hashes=hashes,
+                        signed_hashing=False,
+                        sketch_size=sketch_size,
+                        hash_seed=hash_seed,
+                        random_seed=random_seed)
+
+def feature_entries(labels):
+    return [(key, chrom, pos) for key, (chrom, pos, _) in zip(feature_keys(labels), labels)]
+
+def feature_entry(labels, i):
+    """
+    The (key, chromosome, position) entry of feature i of a block, named
+    the same way as by feature_keys without naming the other features.
+    """
+    occurrence = 0
+    while i - occurrence > 0 and labels[i - occurrence - 1] == labels[i]:
+        occurrence += 1
+
+    chrom, pos, _ = labels[i]
+    key = feature_name(labels[i])
+    if occurrence > 0:
+        key = "{}_{}".format(key, occurrence)
+
+    return (key, chrom, pos)
+
+def indexed_variants(feature_index):
+    """
+    Returns the set of (chromosome, position) pairs of the variants used
+    by the features, or None if the features (i.e., hashed features)
+    can depend on any variant.
+    """
+    if feature_index.keys is None:
+        return None
+
+    return set(zip(feature_index.chromosomes,
+                   map(int, feature_index.positions)))
+
+# hashed features are sums over many variants, so
+# they need more than the one byte used per feature
+HASHED_FEATURE_DTYPE = np.uint32
+SIGNED_HASHED_FEATURE_DTYPE = np.int32
+
+class FeatureBuffer:
+    """
+    Growable buffer of feature columns.  The columns are stored as the
+    rows of an (n_features, n_samples) array so that appending features
+    is contiguous; matrix() returns the (n_samples, n_features) transpose
+    as a view instead of a copy.
+    """
+    def __init__(self, dtype=FEATURE_DTYPE, capacity=1024):
+        self.dtype = dtype
+        self.capacity = capacity
+        self.rows = None
+        self.n_rows = 0
+
+    def reserve(self, n_rows, n_samples):
+        if self.rows is None:
+            self.rows = np.zeros((max(self.capacity, n_rows), n_samples),
+                                 dtype=self.dtype)
+        elif n_rows > self.rows.shape[0]:
+            rows = np.zeros((max(2 * self.rows.shape[0], n_rows), n_samples),
+                            dtype=self.dtype)
+            rows[:self.n_rows] = self.rows[:self.n_rows]
+            self.rows = rows
+
+    def resize(self, n_rows, n_samples):
+        """
+        Sets the number of features, zero-filling any new ones.
+        """
+        self.reserve(n_rows, n_samples)
+        self.n_rows = n_rows
+
+    def append(self, columns):
+        n_samples, n_columns = columns.shape
+        self.reserve(self.n_rows + n_columns, n_samples)
+        self.rows[self.n_rows:self.n_rows + n_columns] = columns.T
+        self.n_rows += n_columns
+
+    def matrix(self):
+        if self.rows is None:
+            return np.zeros((0, 0), dtype=self.dtype)
+
+        return self.rows[:self.n_rows].T
+
+def hash_features(labels, hash_seed=DEFAULT_HASH_SEED):
+    """
+    Returns the 32-bit murmur3 hashes of the names of a block's features.
+    """
+    return np.fromiter((mmh3.hash(feature_name(label), hash_seed) for label in labels),
+                       dtype=np.int32,
+                       count=len(labels))
+
+def hash_buckets(hashes, n_buckets, signed=False):
+    """
+    Maps feature hashes to buckets.  With signed hashing, the sign bit of
+    the hash (which the bucket does not depend on) gives the sign the
+    feature is added with, so collisions cancel out on average.
+    """
+    hashes = hashes.astype(np.int64)
+    buckets = np.abs(hashes) % n_buckets
+    if signed:
+        signs = np.where(hashes >= 0, 1, -1)
+    else:
+        signs = np.ones(len(hashes), dtype=np.int64)
+
+    return buckets, signs
+
+def bucket_sums(columns, buckets, signs, n_buckets):
+    """
+    Sums the (signed) columns of a block falling in each bucket.  Returns
+    an array of shape (n_buckets, n_samples).
+    """
+    assignments = csr_matrix((signs, (buckets, np.arange(len(buckets)))),
+                             shape=(n_buckets, len(buckets)))
+
+    return assignments @ columns.T
+
 class FeatureHashingAccumulator:
-    def __init__(self, n_features, n_samples):
+    """
+    Sums the features hashed into each of n_features buckets.  Column i
+    of the result is bucket i.
+    """
+    def __init__(self, n_features, n_samples, hash_seed=DEFAULT_HASH_SEED, signed=False):
         self.n_features = n_features
         self.n_samples = n_samples
+        self.hash_seed = hash_seed
+        self.signed = signed
+        self.n_seen = 0
 
-    def transform(self, stream):
-        feature_columns = dict()
-        for feature_idx, ((chrom, pos, gt), column) in enumerate(stream, start=1):
-            feature_name = "{}_{}_{}".format(chrom, pos, gt)
+        dtype = SIGNED_HASHED_FEATURE_DTYPE if signed else HASHED_FEATURE_DTYPE
+        self.rows = np.zeros((n_features, n_samples), dtype=dtype)
 
-            # this will cause collisions.  that's okay -- we want that.
-            hash_ = abs(mmh3.hash(feature_name)) % self.n_features
+    def update(self, block):
+        hashes = hash_features(block.labels, self.hash_seed)
 
-            # allows for sparse storage
-            if hash_ in feature_columns:
-                feature_columns[hash_] += np.array(column)
-            else:
-                feature_columns[hash_] = np.array(column)
+        # this will cause collisions.  that's okay -- we want that.
+        buckets, signs = hash_buckets(hashes, self.n_features, self.signed)
+        self.rows += bucket_sums(block.columns, buckets, signs, self.n_features) \
+            .astype(self.rows.dtype)
 
-            if feature_idx % 10000 == 0:
-                print("Chunk", feature_idx // 10000, len(feature_columns))
+        chunk = self.n_seen // 10000
+        self.n_seen += len(hashes)
+        if self.n_seen // 10000 > chunk:
+            print("Chunk", self.n_seen // 10000, self.n_seen)
 
-        # need to transpose, otherwise we get (n_features, n_individuals) instead
-        feature_matrix = np.array(list(feature_columns.values())).T
+    def result(self):
+        feature_matrix = self.rows.T
 
         print(feature_matrix.shape)
 
         return feature_matrix
 
+    def feature_index(self):
+        # the features are re-hashed with the seed when projecting,
+        # so the index stays the same size however many are seen
+        return FeatureIndex(keys=None,
+                            chromosomes=None,
+                            positions=None,
+                            buckets=np.arange(self.n_features),
+                            n_buckets=self.n_features,
+                            hashes=None,
+                            signed_hashing=self.signed,
+                            sketch_size=None,
+                            hash_seed=self.hash_seed,
+                            random_seed=None)
+
+    def transform(self, stream):
+        for block in stream:
+            self.update(block)
+
+        return self.result()
+
 class BottomKAccumulator:
     """
-    Online sampling of columns using bottom-k sketching
+    Online sampling of columns using bottom-k sketching.  The hashes of a
+    block are computed first and only the features that can enter the
+    sketch are offered to the heap, so the columns of the other features
+    are never copied.
     """
-    def __init__(self, n_features):
+    def __init__(self, n_features, hash_seed=DEFAULT_HASH_SEED):
         self.n_features = n_features
+        self.hash_seed = hash_seed
+        self.n_seen = 0
+
+        # Python's built-in heap is a min heap, so we
+        # negate the hashes and feature indices to keep
+        # the features with the smallest hashes. The root
+        # is the feature that will be evicted next.
+        # Also, mmh3.hash returns a 32-bit signed int
+        #
+        # the heap stores the row of the buffer holding each
+        # kept column.  evicted rows are overwritten in place.
+        self.feature_columns = []
+        self.rows = None
+        self.row_entries = [None] * n_features
+
+    def _offer(self, hash_, feature_idx, column):
+        """
+        Returns the buffer row the column was stored in or None
+        if it did not enter the sketch.
+        """
+        # we use the feature_idx to break ties
+        if len(self.feature_columns) < self.n_features:
+            if self.rows is None:
+                self.rows = np.zeros((self.n_features, len(column)),
+                                     dtype=column.dtype)
+            row = len(self.feature_columns)
+            self.rows[row] = column
+            heapq.heappush(self.feature_columns, (-hash_, -feature_idx, row))
+            return row
+        elif (-hash_, -feature_idx) > self.feature_columns[0][:2]:
+            row = self.feature_columns[0][2]
+            self.rows[row] = column
+            heapq.heapreplace(self.feature_columns, (-hash_, -feature_idx, row))
+            return row
+
+        return None
+
+    def _candidates(self, hashes):
+        """
+        Selects the features of a block that could enter the sketch: those
+        among the block's own bottom-k that also beat the current root.
+        """
+        candidates = np.ones(len(hashes), dtype=bool)
+        if len(hashes) > self.n_features:
+            kth_hash = np.partition(hashes, self.n_features - 1)[self.n_features - 1]
+            candidates &= hashes <= kth_hash
+
+        # later features lose ties, so they need a strictly smaller hash
+        if len(self.feature_columns) == self.n_features:
+            candidates &= hashes < -self.feature_columns[0][0]
+
+        return np.flatnonzero(candidates)
+
+    def update(self, block):
+        hashes = np.abs(hash_features(block.labels, self.hash_seed).astype(np.int64))
+
+        if self.n_features > 0:
+            for i in self._candidates(hashes):
+                row = self._offer(int(hashes[i]), self.n_seen + i, block.columns[:, i])
+                if row is not None:
+                    self.row_entries[row] = feature_entry(block.labels, i)
+
+        chunk = self.n_seen // 10000
+        self.n_seen += len(hashes)
+        if self.n_seen // 10000 > chunk:
+            print("Chunk", self.n_seen // 10000, len(self.feature_columns))
+
+    def merge(self, other):
+        """
+        Combines the sketch of an accumulator that saw the features
+        following the ones seen by this accumulator.
+        """
+        for neg_hash, neg_feature_idx, other_row in other.feature_columns:
+            row = self._offer(-neg_hash,
+                              self.n_seen - neg_feature_idx,
+                              other.rows[other_row])
+            if row is not None:
+                self.row_entries[row] = other.row_entries[other_row]
+
+        self.n_seen += other.n_seen
+
+    def _sorted_rows(self):
+        # drop the hash and feature idx, keeping the stream order
+        return [row for _, _, row in
+                sorted(self.feature_columns,
+                       key=lambda item: -item[1])]
+
+    def result(self):
+        if self.rows is None:
+            return np.zeros((0, 0), dtype=FEATURE_DTYPE)
+
+        feature_matrix = self.rows[self._sorted_rows()].T
+
+        return feature_matrix
+
+    def feature_index(self):
+        items = sorted(self.feature_columns, key=lambda item: -item[1])
+
+        return keyed_feature_index([self.row_entries[row] for _, _, row in items],
+                                   hash_seed=self.hash_seed,
+                                   hashes=np.array([-neg_hash for neg_hash, _, _ in items],
+                                                   dtype=np.int64),
+                                   sketch_size=self.n_features)
 
     def transform(self, stream):
-        feature_columns = []
-        for feature_idx, ((chrom, pos, gt), column) in enumerate(stream):
-            feature_name = "{}_{}_{}".format(chrom, pos, gt)
-
-            # Python's built-in heap is a min heap, so it
-            # will keep the largest elements.  In practice,
-            # this probably doesn't matter but we are going
-            # to negate the hashes anyway so it keeps the
-            # smallest elements.  Note that for signed ints,
-            # 0 replaces one of the positive values so we can
-            # convert any positive value to negative without an
-            # overflow but not the other way around
-            # Also, mmh3.hash returns a 32-bit signed int
-            hash_ = abs(mmh3.hash(feature_name))
-
-            # we use the feature_idx to break ties since numpy arrays
-            # are not comparable (sortable)
-            if len(feature_columns) < self.n_features:
-                heapq.heappush(feature_columns,
-                               (hash_, feature_idx, column))
-            else:
-                heapq.heapreplace(feature_columns,
-                                  (hash_, feature_idx, column))
-
-            if feature_idx % 10000 == 0:
-                print("Chunk", feature_idx // 10000, len(feature_columns))
-
-        # drop the hash and feature idx
-        feature_columns = [column for _, _, column in feature_columns]
-
-        # need to transpose, otherwise we get (n_features, n_individuals) instead
-        feature_matrix = np.array(feature_columns).T
+        for block in stream:
+            self.update(block)
 
-        return feature_matrix
+        return self.result()
+
+def load_bottomk_sketch(feature_matrix, feature_index):
+    """
+    Recreates the bottom-k sketch of a project from its feature matrix and
+    feature index so that it can be merged with the sketches of other
+    projects (e.g., other chromosomes).  The project's columns are treated
+    as the features of a stream in column order.
+    """
+    if feature_index.sketch_size is None or feature_index.hashes is None:
+        raise Exception("Feature index does not describe a bottom-k sketch.")
+
+    feature_matrix = np.asarray(feature_matrix)
+    n_columns = feature_matrix.shape[1]
+
+    accumulator = BottomKAccumulator(feature_index.sketch_size,
+                                     hash_seed=feature_index.hash_seed)
+    accumulator.n_seen = n_columns
+    if n_columns > 0:
+        accumulator.rows = np.zeros((feature_index.sketch_size, feature_matrix.shape[0]),
+                                    dtype=feature_matrix.dtype)
+        accumulator.rows[:n_columns] = feature_matrix.T
+
+    for i in range(n_columns):
+        accumulator.row_entries[i] = (feature_index.keys[i],
+                                      feature_index.chromosomes[i],
+                                      feature_index.positions[i])
+        accumulator.feature_columns.append((-int(feature_index.hashes[i]), -i, i))
+    heapq.heapify(accumulator.feature_columns)
+
+    return accumulator
+
+def merge_bottomk_sketches(sketches):
+    """
+    Merges the bottom-k sketches of consecutive parts of a stream (given
+    in stream order) into the sketch of the whole stream.  The merged
+    sketch holds as many features as the smallest input sketch, which is
+    the most that can be recovered exactly.
+    """
+    sketch_size = min(sketch.n_features for sketch in sketches)
+    merged = BottomKAccumulator(sketch_size, hash_seed=sketches[0].hash_seed)
+    for sketch in sketches:
+        if sketch.hash_seed != merged.hash_seed:
+            raise Exception("Sketches were built with different hash seeds.")
+        merged.merge(sketch)
+
+    return merged
 
 class FullMatrixAccumulator:
-    def transform(self, stream):
-        feature_columns = []
-        for feature_idx, (_, column) in enumerate(stream, start=1):
-            feature_columns.append(column)
+    def __init__(self):
+        self.buffer = FeatureBuffer()
+        self.entries = []
+        self.n_seen = 0
 
-            if feature_idx % 10000 == 0:
-                print("Chunk", feature_idx // 10000, len(feature_columns))
+    def update(self, block):
+        self.buffer.append(block.columns)
+        self.entries.extend(feature_entries(block.labels))
 
+        chunk = self.n_seen // 10000
+        self.n_seen += block.columns.shape[1]
+        if self.n_seen // 10000 > chunk:
+            print("Chunk", self.n_seen // 10000, self.n_seen)
 
-        # need to transpose, otherwise we get (n_features, n_individuals) instead
-        feature_matrix = np.array(feature_columns).T
+    def result(self):
+        feature_matrix = self.buffer.matrix()
 
         return feature_matrix
 
-class ReservoirMatrixAccumulator:
+    def feature_index(self):
+        return keyed_feature_index(self.entries)
+
+    def transform(self, stream):
+        for block in stream:
+            self.update(block)
+
+        return self.result()
+
+class SparseMatrixAccumulator:
     """
-    Online sampling of columns using reservoir sampling.
+    Keeps all of the features in a CSC sparse matrix.  Only the non-zero
+    entries are stored, which suits indicator features such as genotype
+    categories, where at most one of a variant's three columns is set for
+    each sample.
     """
-    def __init__(self, n_features):
-        self.n_features = n_features
+    def __init__(self):
+        self.values = []
+        self.row_indices = []
+        self.column_counts = []
+        self.n_samples = None
+        self.entries = []
+        self.n_seen = 0
+
+    def update(self, block):
+        n_samples, n_columns = block.columns.shape
+        self.n_samples = n_samples
+
+        # nonzero() of the transpose returns the entries column by column
+        rows = block.columns.T
+        columns, samples = np.nonzero(rows)
+        self.values.append(rows[columns, samples])
+        self.row_indices.append(samples.astype(np.int32))
+        self.column_counts.append(np.bincount(columns, minlength=n_columns))
+        self.entries.extend(feature_entries(block.labels))
+
+        chunk = self.n_seen // 10000
+        self.n_seen += n_columns
+        if self.n_seen // 10000 > chunk:
+            print("Chunk", self.n_seen // 10000, self.n_seen)
+
+    def result(self):
+        if self.n_samples is None:
+            return csc_matrix((0, 0), dtype=FEATURE_DTYPE)
+
+        # scipy uses the same integer type for the indices and
+        # the column pointers, so only switch to 64-bit if needed
+        column_counts = np.concatenate(self.column_counts)
+        index_dtype = np.int32
+        if column_counts.sum() > np.iinfo(np.int32).max:
+            index_dtype = np.int64
+
+        indptr = np.zeros(self.n_seen + 1, dtype=index_dtype)
+        np.cumsum(column_counts, out=indptr[1:])
+
+        feature_matrix = csc_matrix((np.concatenate(self.values),
+                                     np.concatenate(self.row_indices).astype(index_dtype, copy=False),
+                                     indptr),
+                                    shape=(self.n_samples, self.n_seen))
+
+        return feature_matrix
+
+    def feature_index(self):
+        return keyed_feature_index(self.entries)
 
     def transform(self, stream):
-        feature_columns = []
-        for feature_idx, (_, column) in enumerate(stream):
-            if feature_idx < self.n_features:
-                feature_columns.append(column)
-            else:
-                j = random.randint(0, feature_idx + 1)
-                if j < self.n_features:
-                    feature_columns[j] = column
+        for block in stream:
+            self.update(block)
 
-            if feature_idx % 10000 == 0:
-                print("Chunk", feature_idx // 10000, len(feature_columns))
+        return self.result()
 
-        # need to transpose, otherwise we get (n_features, n_individuals) instead
-        feature_matrix = np.array(feature_columns).T
+class ReservoirMatrixAccumulator:
+    """
+    Online sampling of columns using reservoir sampling.  Once the
+    reservoir is full, the gaps between replaced columns are drawn from
+    their geometric distribution (Li's Algorithm L), so the columns that
+    are skipped are never touched.
+    """
+    def __init__(self, n_features, random_seed=None):
+        self.n_features = n_features
+        self.n_seen = 0
+        self.n_kept = 0
+        self.rows = None
+        self.row_entries = [None] * n_features
+
+        # Algorithm L state: the largest random key in the reservoir
+        # (kept in log space) and the index of the next column to keep
+        self.log_threshold = 0.0
+        self.next_idx = None
+
+        # record the seed so the sample can be reproduced
+        if random_seed is None:
+            random_seed = random.randrange(2 ** 32)
+        self.random_seed = random_seed
+        self.rng = random.Random(random_seed)
+
+    def _uniform(self):
+        # uniform on (0, 1) so its log is finite
+        u = self.rng.random()
+        while u == 0.0:
+            u = self.rng.random()
+        return u
+
+    def _schedule_next(self, last_idx):
+        """
+        Draws the number of columns skipped after column last_idx.
+        """
+        log_reject = math.log(-math.expm1(self.log_threshold)) \
+            if self.log_threshold < 0.0 else -math.inf
+        if log_reject == 0.0:
+            n_skipped = math.inf
+        else:
+            n_skipped = math.floor(math.log(self._uniform()) / log_reject)
+        self.next_idx = last_idx + n_skipped + 1
+
+    def update(self, block):
+        if self.rows is None:
+            self.rows = np.zeros((self.n_features, block.columns.shape[0]),
+                                 dtype=block.columns.dtype)
+
+        start = self.n_seen
+        end = start + len(block.labels)
+
+        n_filled = min(self.n_features - self.n_kept, end - start)
+        if n_filled > 0:
+            self.rows[self.n_kept:self.n_kept + n_filled] = block.columns[:, :n_filled].T
+            self.row_entries[self.n_kept:self.n_kept + n_filled] = \
+                feature_entries(block.labels[:n_filled])
+            self.n_kept += n_filled
+
+            if self.n_kept == self.n_features:
+                self.log_threshold = math.log(self._uniform()) / self.n_features
+                self._schedule_next(start + n_filled - 1)
+
+        while self.next_idx is not None and self.next_idx < end:
+            i = self.next_idx - start
+            j = self.rng.randrange(self.n_features)
+            self.rows[j] = block.columns[:, i]
+            self.row_entries[j] = feature_entry(block.labels, i)
+
+            self.log_threshold += math.log(self._uniform()) / self.n_features
+            self._schedule_next(self.next_idx)
+
+        chunk = self.n_seen // 10000
+        self.n_seen = end
+        if self.n_seen // 10000 > chunk:
+            print("Chunk", self.n_seen // 10000, self.n_kept)
+
+    def merge(self, other):
+        """
+        Combines two reservoirs into a uniform sample of the union of the
+        two streams.  The number of columns taken from each reservoir
+        follows a hypergeometric distribution weighted by the number of
+        features each accumulator saw.
+        """
+        n_kept = min(self.n_features, self.n_seen + other.n_seen)
+        if other.n_seen == 0:
+            n_from_self = self.n_kept
+        elif self.n_seen == 0:
+            n_from_self = 0
+        else:
+            numpy_rng = np.random.default_rng(self.rng.getrandbits(32))
+            n_from_self = numpy_rng.hypergeometric(self.n_seen,
+                                                   other.n_seen,
+                                                   n_kept)
+
+        kept_rows = []
+        kept_entries = []
+        if n_from_self > 0:
+            sampled = self.rng.sample(range(self.n_kept), n_from_self)
+            kept_rows.append(self.rows[sampled])
+            kept_entries.extend(self.row_entries[i] for i in sampled)
+        if n_kept > n_from_self:
+            sampled = self.rng.sample(range(other.n_kept), n_kept - n_from_self)
+            kept_rows.append(other.rows[sampled])
+            kept_entries.extend(other.row_entries[i] for i in sampled)
+
+        if len(kept_rows) > 0:
+            kept_rows = np.vstack(kept_rows)
+            self.rows = np.zeros((self.n_features, kept_rows.shape[1]),
+                                 dtype=kept_rows.dtype)
+            self.rows[:n_kept] = kept_rows
+            self.row_entries = kept_entries + [None] * (self.n_features - n_kept)
+
+        self.n_kept = n_kept
+        self.n_seen += other.n_seen
+
+        # the largest key of a full reservoir is the n_features-th
+        # smallest of n_seen uniform keys, which is Beta distributed
+        if self.n_kept == self.n_features and self.n_features > 0:
+            numpy_rng = np.random.default_rng(self.rng.getrandbits(32))
+            self.log_threshold = math.log(numpy_rng.beta(self.n_features,
+                                                         self.n_seen - self.n_features + 1))
+            self._schedule_next(self.n_seen - 1)
+
+    def result(self):
+        if self.rows is None:
+            return np.zeros((0, 0), dtype=FEATURE_DTYPE)
+
+        feature_matrix = self.rows[:self.n_kept].T
 
         return feature_matrix
 
-def construct_feature_matrix(variant_stream, n_samples, feature_type, sampling_method, n_dim):
-    print("Using feature type:", feature_type)
-    if sampling_method is not None:
-        print("Using sampling method:", sampling_method)
-        print("Using", n_dim, "dimensions")
+    def feature_index(self):
+        return keyed_feature_index(self.row_entries[:self.n_kept],
+                                   random_seed=self.random_seed)
+
+    def transform(self, stream):
+        for block in stream:
+            self.update(block)
+
+        return self.result()
 
+def make_extractor(feature_type, variant_stream):
     if feature_type == COUNTS_FEATURE_TYPE:
         extractor = CountFeaturesExtractor(variant_stream)
     elif feature_type == CATEGORIES_FEATURE_TYPE:
@@ -159,18 +660,159 @@ def construct_feature_matrix(variant_stream, n_samples, feature_type, sampling_m
     else:
         raise Exception("Unknown feature type: %s" % feature_type)
 
-    if sampling_method is None:
+    return extractor
+
+def make_accumulator(n_samples, sampling_method, n_dim, hash_seed=DEFAULT_HASH_SEED, random_seed=None, signed_hashing=False, sparse=False):
+    if sampling_method is None and sparse:
+        accumulator = SparseMatrixAccumulator()
+    elif sampling_method is None:
         accumulator = FullMatrixAccumulator()
     elif sampling_method == RESERVOIR_SAMPLING:
-        accumulator = ReservoirMatrixAccumulator(n_dim)
+        accumulator = ReservoirMatrixAccumulator(n_dim, random_seed=random_seed)
     elif sampling_method == FEATURE_HASHING:
-        accumulator = FeatureHashingAccumulator(n_dim, n_samples)
+        accumulator = FeatureHashingAccumulator(n_dim,
+                                                n_samples,
+                                                hash_seed=hash_seed,
+                                                signed=signed_hashing)
     elif sampling_method == BOTTOMK_SKETCHING:
-        accumulator = BottomKAccumulator(n_dim)
+        accumulator = BottomKAccumulator(n_dim, hash_seed=hash_seed)
     else:
         raise Exception("Sampling method '%s' not implemented" % \
                             sampling_method)
 
+    return accumulator
+
+def construct_feature_matrix(variant_stream, n_samples, feature_type, sampling_method, n_dim, hash_seed=DEFAULT_HASH_SEED, random_seed=None, signed_hashing=False, sparse=False):
+    """
+    Returns the feature matrix and the FeatureIndex describing its columns
+    (including the seeds used to select them).  Without sampling, the
+    matrix can be accumulated as a scipy.sparse CSC matrix.
+    """
+    print("Using feature type:", feature_type)
+    if sampling_method is not None:
+        print("Using sampling method:", sampling_method)
+        print("Using", n_dim, "dimensions")
+
+    extractor = make_extractor(feature_type, variant_stream)
+    accumulator = make_accumulator(n_samples,
+                                   sampling_method,
+                                   n_dim,
+                                   hash_seed=hash_seed,
+                                   random_seed=random_seed,
+                                   signed_hashing=signed_hashing,
+                                   sparse=sparse)
+
     feature_matrix = accumulator.transform(extractor)
 
-    return feature_matrix
+    return feature_matrix, accumulator.feature_index()
+
+def _extract_lines(task):
+    """
+    Worker for construct_feature_matrix_parallel.  Decodes, filters, and
+    extracts features from a chunk of VCF lines and returns the chunk's
+    FeatureBlocks.
+    """
+    lines, n_columns, kept_indices, allele_min_freq_threshold, feature_type = task
+
+    variants = filter_invariant_blocks(allele_min_freq_threshold,
+                                       [decode_genotype_block(lines,
+                                                              n_columns,
+                                                              kept_indices)])
+
+    return list(make_extractor(feature_type, variants))
+
+def construct_feature_matrix_parallel(vcf_stream, allele_min_freq_threshold, feature_type, sampling_method, n_dim, n_workers, hash_seed=DEFAULT_HASH_SEED, random_seed=None, signed_hashing=False, sparse=False):
+    """
+    Splits the lines of a VCFStreamer across a pool of worker processes,
+    which parse, filter, and extract features from their share.  The
+    workers only return the features of their chunks (no larger than the
+    chunks themselves), which are added to a single accumulator in the
+    original variant order.  The results match construct_feature_matrix.
+    """
+    print("Using feature type:", feature_type)
+    if sampling_method is not None:
+        print("Using sampling method:", sampling_method)
+        print("Using", n_dim, "dimensions")
+    print("Using", n_workers, "workers")
+
+    n_columns = vcf_stream.n_columns
+    kept_indices = vcf_stream.kept_indices
+    accumulator = make_accumulator(len(kept_indices),
+                                   sampling_method,
+                                   n_dim,
+                                   hash_seed=hash_seed,
+                                   random_seed=random_seed,
+                                   signed_hashing=signed_hashing,
+                                   sparse=sparse)
+
+    def update(blocks):
+        for block in blocks:
+            accumulator.update(block)
+
+    # bound the number of chunks in flight so the reader
+    # cannot get arbitrarily far ahead of the workers
+    max_pending = 2 * n_workers
+    pending = deque()
+    with multiprocessing.Pool(n_workers) as pool:
+        for lines in vcf_stream.line_blocks():
+            task = (lines, n_columns, kept_indices, allele_min_freq_threshold, feature_type)
+            pending.append(pool.apply_async(_extract_lines, (task,)))
+
+            if len(pending) >= max_pending:
+                update(pending.popleft().get())
+
+        while len(pending) > 0:
+            update(pending.popleft().get())
+
+    feature_matrix = accumulator.result()
+
+    return feature_matrix, accumulator.feature_index()
+
+def project_features(variant_stream, n_samples, feature_type, feature_index):
+    """
+    Builds the feature matrix for a new set of samples with the same
+    columns as the matrix described by feature_index.  Features that were
+    not used are skipped and features missing from the stream are zero.
+    Hashed features are all added to their buckets.
+    """
+    extractor = make_extractor(feature_type, variant_stream)
+
+    if feature_index.buckets is not None:
+        n_features = len(feature_index.buckets)
+        bucket_columns = np.full(feature_index.n_buckets, -1, dtype=np.int64)
+        bucket_columns[feature_index.buckets] = np.arange(n_features)
+
+        signed = bool(feature_index.signed_hashing)
+        dtype = SIGNED_HASHED_FEATURE_DTYPE if signed else HASHED_FEATURE_DTYPE
+        rows = np.zeros((n_features, n_samples), dtype=dtype)
+
+        n_matched = 0
+        for block in extractor:
+            hashes = hash_features(block.labels, feature_index.hash_seed)
+            buckets, signs = hash_buckets(hashes, feature_index.n_buckets, signed)
+            rows += bucket_sums(block.columns,
+                                bucket_columns[buckets],
+                                signs,
+                                n_features).astype(dtype)
+            n_matched += len(hashes)
+
+        print("Matched", n_matched, "features")
+
+        return rows.T
+
+    n_features = len(feature_index.keys)
+    key_columns = { key : col for col, key in enumerate(feature_index.keys) }
+    rows = np.zeros((n_features, n_samples), dtype=FEATURE_DTYPE)
+
+    n_matched = 0
+    for block in extractor:
+        matches = [(i, key_columns[key]) for i, key in enumerate(feature_keys(block.labels))
+                   if key in key_columns]
+        if len(matches) > 0:
+            block_idx, columns = zip(*matches)
+            np.add.at(rows, list(columns), block.columns[:, list(block_idx)].T)
+            n_matched += len(matches)
+
+    print("Matched", n_matched, "features")
+
+    return rows.T
@@ -0,0 +1,262 @@
+"""
+This module provides a compact binary genotype store that is written once from a VCF
+file and then read with memory mapping, so that repeated analyses do not need to
+re-parse the text VCF.  Genotypes are stored as one byte per sample and variant along
+with arrays of positions, chromosomes, alleles, and minor allele frequencies.
+
+Copyright 2015 Ronald J. Nowling
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from .models import VariantBlock
+from .vcf import DEFAULT_BLOCK_SIZE
+from .vcf import filter_invariant_blocks
+from .vcf import parse_region
+
+STORE_FORMAT_VERSION = 1
+
+HEADER_FLNAME = "header.json"
+GENOTYPES_FLNAME = "genotypes.bin"
+POSITIONS_FLNAME = "positions.npy"
+CHROMOSOMES_FLNAME = "chromosomes.npy"
+REF_ALLELES_FLNAME = "ref_alleles.npy"
+ALT_ALLELES_FLNAME = "alt_alleles.npy"
+MAF_FLNAME = "maf.npy"
+
+# each genotype is stored as ref_count * 3 + alt_count
+CODE_BASE = 3
+DECODE_TABLE = np.array([(code // CODE_BASE, code % CODE_BASE)
+                         for code in range(CODE_BASE * CODE_BASE)],
+                        dtype=np.int8)
+
+def encode_genotypes(genotypes):
+    """
+    Converts an (n_variants, n_samples, 2) array of (ref_count, alt_count)
+    pairs to an (n_variants, n_samples) array of one-byte codes.
+    """
+    return (genotypes[:, :, 0] * CODE_BASE + genotypes[:, :, 1]).astype(np.uint8)
+
+def decode_genotypes(codes):
+    return DECODE_TABLE[codes]
+
+def minor_allele_fractions(genotypes):
+    """
+    Returns the fraction of the least-frequently occurring allele for each
+    variant, or -1 for variants where all genotypes are unknown.
+    """
+    allele_counts = genotypes.sum(axis=1, dtype=np.int64)
+    total_counts = allele_counts.sum(axis=1)
+    fractions = allele_counts.min(axis=1) / np.maximum(total_counts, 1)
+    fractions[total_counts == 0] = -1.0
+
+    return fractions
+
+def write_genotype_store(dirname, blocks, sample_names, source=None):
+    """
+    Writes a stream of VariantBlocks to a genotype store directory.
+    """
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+
+    chromosome_names = []
+    chromosome_codes = dict()
+    positions = []
+    chromosomes = []
+    ref_alleles = []
+    alt_alleles = []
+    fractions = []
+    n_variants = 0
+
+    with open(os.path.join(dirname, GENOTYPES_FLNAME), "wb") as fl:
+        for block in blocks:
+            fl.write(encode_genotypes(block.genotypes).tobytes())
+
+            codes = np.empty(len(block.chromosomes), dtype=np.uint32)
+            for i, chrom in enumerate(block.chromosomes):
+                if chrom not in chromosome_codes:
+                    chromosome_codes[chrom] = len(chromosome_names)
+                    chromosome_names.append(chrom)
+                codes[i] = chromosome_codes[chrom]
+
+            chromosomes.append(codes)
+            positions.append(block.positions)
+            ref_alleles.append(np.char.encode(block.ref_alleles.astype(str), "utf-8"))
+            alt_alleles.append(np.char.encode(block.alt_alleles.astype(str), "utf-8"))
+            fractions.append(minor_allele_fractions(block.genotypes))
+
+            n_variants += len(block.positions)
+            print("Imported", n_variants, "variants")
+
+    def concatenate(arrays, dtype):
+        if len(arrays) == 0:
+            return np.array([], dtype=dtype)
+        return np.concatenate(arrays)
+
+    np.save(os.path.join(dirname, POSITIONS_FLNAME), concatenate(positions, np.int64))
+    np.save(os.path.join(dirname, CHROMOSOMES_FLNAME), concatenate(chromosomes, np.uint32))
+    np.save(os.path.join(dirname, REF_ALLELES_FLNAME), concatenate(ref_alleles, "S1"))
+    np.save(os.path.join(dirname, ALT_ALLELES_FLNAME), concatenate(alt_alleles, "S1"))
+    np.save(os.path.join(dirname, MAF_FLNAME), concatenate(fractions, np.float64))
+
+    header = { "format_version" : STORE_FORMAT_VERSION,
+               "n_variants" : n_variants,
+               "n_samples" : len(sample_names),
+               "sample_names" : list(sample_names),
+               "chromosome_names" : chromosome_names,
+               "source" : source }
+
+    with open(os.path.join(dirname, HEADER_FLNAME), "wt", encoding="utf-8") as fl:
+        json.dump(header, fl)
+
+    return header
+
+class GenotypeStore:
+    """
+    Memory-mapped reader for a genotype store directory.
+    """
+    def __init__(self, dirname):
+        header_flname = os.path.join(dirname, HEADER_FLNAME)
+        if not os.path.exists(header_flname):
+            raise Exception("'%s' is not a genotype store." % dirname)
+
+        with open(header_flname, "rt", encoding="utf-8") as fl:
+            header = json.load(fl)
+
+        if header["format_version"] != STORE_FORMAT_VERSION:
+            raise Exception("Unsupported genotype store version %s" % header["format_version"])
+
+        self.dirname = dirname
+        self.n_variants = header["n_variants"]
+        self.sample_names = header["sample_names"]
+        self.chromosome_names = np.array(header["chromosome_names"], dtype=object)
+
+        self.genotypes = np.memmap(os.path.join(dirname, GENOTYPES_FLNAME),
+                                   dtype=np.uint8,
+                                   mode="r",
+                                   shape=(self.n_variants, len(self.sample_names)))
+
+        def load(flname):
+            return np.load(os.path.join(dirname, flname), mmap_mode="r")
+
+        self.positions = load(POSITIONS_FLNAME)
+        self.chromosomes = load(CHROMOSOMES_FLNAME)
+        self.ref_alleles = load(REF_ALLELES_FLNAME)
+        self.alt_alleles = load(ALT_ALLELES_FLNAME)
+        self.minor_allele_fractions = load(MAF_FLNAME)
+
+    def region_mask(self, regions):
+        mask = np.zeros(self.n_variants, dtype=bool)
+        for region in regions:
+            chrom, start, end = parse_region(region) if isinstance(region, str) else region
+            codes = np.flatnonzero(self.chromosome_names == chrom)
+            if len(codes) == 0:
+                continue
+
+            mask |= (self.chromosomes == codes[0]) & \
+                (self.positions >= start) & \
+                (self.positions <= end)
+
+        return mask
+
+    def variant_mask(self, variants):
+        """
+        Selects the variants whose (chrom, pos) pair is in the given set.
+        """
+        by_chrom = {}
+        for chrom, pos in variants:
+            by_chrom.setdefault(chrom, []).append(pos)
+
+        mask = np.zeros(self.n_variants, dtype=bool)
+        for chrom, positions in by_chrom.items():
+            codes = np.flatnonzero(self.chromosome_names == chrom)
+            if len(codes) == 0:
+                continue
+
+            mask |= (self.chromosomes == codes[0]) & \
+                np.isin(self.positions, positions)
+
+        return mask
+
+    def blocks(self, kept_individuals=None, allele_min_freq_threshold=None, regions=None, block_size=DEFAULT_BLOCK_SIZE, variants=None):
+        """
+        Yields VariantBlocks for the selected samples (in store order).  When
+        all samples are kept, the minor allele frequency filter is a lookup
+        of the stored frequencies, so filtered variants are never decoded.
+        Otherwise, the frequencies are recomputed for the kept samples.  If a
+        set of (chrom, pos) variants is given, only those variants are read.
+        """
+        kept_indices = self.kept_indices(kept_individuals)
+        all_samples = len(kept_indices) == len(self.sample_names)
+
+        mask = np.ones(self.n_variants, dtype=bool)
+        if regions:
+            mask &= self.region_mask(regions)
+
+        if variants is not None:
+            mask &= self.variant_mask(variants)
+
+        if allele_min_freq_threshold is not None and all_samples:
+            mask &= self.minor_allele_fractions >= allele_min_freq_threshold
+
+        blocks = self._read_blocks(np.flatnonzero(mask),
+                                   None if all_samples else kept_indices,
+                                   block_size)
+
+        if allele_min_freq_threshold is not None and not all_samples:
+            blocks = filter_invariant_blocks(allele_min_freq_threshold, blocks)
+
+        return blocks
+
+    def _read_blocks(self, selected, kept_indices, block_size):
+        for start in range(0, len(selected), block_size):
+            indices = selected[start:start + block_size]
+
+            codes = self.genotypes[indices]
+            if kept_indices is not None:
+                codes = codes[:, kept_indices]
+
+            yield VariantBlock(self.chromosome_names[self.chromosomes[indices]],
+                               np.asarray(self.positions[indices]),
+                               np.char.decode(self.ref_alleles[indices], "utf-8").astype(object),
+                               np.char.decode(self.alt_alleles[indices], "utf-8").astype(object),
+                               decode_genotypes(codes))
+
+    def kept_indices(self, kept_individuals=None):
+        if not kept_individuals:
+            return np.arange(len(self.sample_names))
+
+        kept_individuals = set(kept_individuals)
+        return np.array([i for i, name in enumerate(self.sample_names)
+                         if name in kept_individuals],
+                        dtype=np.int64)
+
+    def kept_names(self, kept_individuals=None):
+        return [self.sample_names[i] for i in self.kept_indices(kept_individuals)]
+
+def stream_store_variants(store_dirname, allele_min_freq_threshold, kept_individuals=None, regions=None):
+    """
+    Genotype store counterpart of stream_vcf_variants.  Returns a stream of
+    filtered VariantBlocks and the names of the kept samples.
+    """
+    store = GenotypeStore(store_dirname)
+    variants = store.blocks(kept_individuals=kept_individuals,
+                            allele_min_freq_threshold=allele_min_freq_threshold,
+                            regions=regions)
+
+    return variants, store.kept_names(kept_individuals)
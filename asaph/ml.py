@@ -20,6 +20,8 @@ limitations under the License.
 
 import numpy as np
 
+from scipy.special import expit
+from scipy.special import fdtrc
 from scipy.stats import chi2
 from scipy.stats import shapiro
 from scipy.stats import ttest_1samp
@@ -32,65 +34,102 @@ def estimate_lr_iter(n_samples):
     return max(20,
                int(np.ceil(100000. / n_samples)))
 
-def upsample_features(labels, features):
-    n_samples, n_features = features.shape
+SGD_SOLVER = "sgd"
+EXACT_SOLVER = "exact"
+
+DEFAULT_IRLS_ITER = 25
+
+def upsample_feature_blocks(labels, features):
+    """
+    Stacked version of upsample_features.  features is an
+    (n_snps, n_samples, n_features) array of one-hot genotypes and the
+    result is an (n_snps, n_features * n_samples, n_features) array.
+    """
+    n_snps, n_samples, n_features = features.shape
 
     # we make 1 copy for each variable so we can impute each unknown genotype
-    N_COPIES = features.shape[1]
-    training_labels = np.zeros(N_COPIES * n_samples)
-    training_features = np.zeros((N_COPIES * n_samples, n_features))
+    N_COPIES = n_features
+    training_labels = np.repeat(np.asarray(labels, dtype=np.float64), N_COPIES)
+
+    known = np.repeat(features.sum(axis=2) > 0, N_COPIES, axis=1)
+    imputed = np.tile(np.eye(N_COPIES), (n_samples, 1))
+    training_features = np.where(known[:, :, np.newaxis],
+                                 np.repeat(features, N_COPIES, axis=1),
+                                 imputed)
+
+    return training_labels, training_features.astype(np.float64)
+
+def upsample_features(labels, features, weighted=False):
+    """
+    Expands the one-hot genotypes so each unknown genotype is imputed
+    with every category.  By default, every sample is repeated once per
+    category.  In weighted mode, known genotypes appear once with a
+    weight of 1 and unknown genotypes appear once per category with a
+    weight of 1 / n_features, and the weights are returned as well.
+    """
+    if not weighted:
+        training_labels, training_features = upsample_feature_blocks(labels,
+                                                                     features[np.newaxis, :, :])
+
+        return training_labels, training_features[0]
 
-    for i in range(n_samples):
-        gt = None
-        if features[i, :].sum() > 0:
-            gt = features[i, :].argmax()
+    n_samples, n_features = features.shape
+    known = features.sum(axis=1) > 0
+    n_rows = np.where(known, 1, n_features)
 
-        for j in range(N_COPIES):
-            idx = N_COPIES * i + j
-            training_labels[idx] = labels[i]
+    sample_idx = np.repeat(np.arange(n_samples), n_rows)
+    copy_idx = np.arange(len(sample_idx)) - np.repeat(np.cumsum(n_rows) - n_rows, n_rows)
+    imputed = ~known[sample_idx]
 
-            if gt is not None:
-                training_features[idx, :] = features[i, :]
-            else:
-                training_features[idx, j] = 1.
+    training_labels = np.asarray(labels, dtype=np.float64)[sample_idx]
+    training_features = features[sample_idx].astype(np.float64)
+    training_features[imputed] = np.eye(n_features)[copy_idx[imputed]]
+    sample_weight = 1.0 / n_rows[sample_idx]
 
-    return training_labels, training_features
+    return training_labels, training_features, sample_weight
 
-def lin_reg_log_likelihood(lr, X, y):
+def lin_reg_log_likelihood(lr, X, y, sample_weight=None):
     pred_y = lr.predict(X)
-    N, _ = X.shape
+
+    if sample_weight is None:
+        sample_weight = np.ones(X.shape[0])
+    N = sample_weight.sum()
 
     # estimate variance (sigma2)
-    avg_y = np.mean(y)
+    avg_y = np.average(y, weights=sample_weight)
     diff = y - avg_y
-    diff2 = np.dot(diff, diff)
+    diff2 = np.dot(sample_weight * diff, diff)
     sigma2 = diff2 / (N - 1)
 
     # residual sum of squares
     error = y - pred_y
-    error2 = np.dot(error, error)
+    error2 = np.dot(sample_weight * error, error)
 
     log_likelihood = -N * np.log(2. * np.pi * sigma2) / 2. - error2 / (2.0 * sigma2)
 
     return log_likelihood
 
-def lin_reg_lrtest(X, y, n_iter, g_scaling_factor=1.0):
+def lin_reg_lrtest(X, y, n_iter, g_scaling_factor=1.0, sample_weight=None):
     null_lr = SGDRegressor(fit_intercept = True, max_iter=n_iter)
     null_X = np.zeros((X.shape[0], 1))
     null_lr.fit(null_X,
-                y)
+                y,
+                sample_weight=sample_weight)
 
     alt_lr = SGDRegressor(fit_intercept = False, max_iter=n_iter)
     alt_lr.fit(X,
-               y)
+               y,
+               sample_weight=sample_weight)
 
     null_likelihood = lin_reg_log_likelihood(null_lr,
                                              null_X,
-                                             y)
+                                             y,
+                                             sample_weight=sample_weight)
 
     alt_likelihood = lin_reg_log_likelihood(alt_lr,
                                             X,
-                                            y)
+                                            y,
+                                            sample_weight=sample_weight)
 
     G = g_scaling_factor * 2. * (alt_likelihood - null_likelihood)
 
@@ -130,25 +169,248 @@ def genotype_normality_test(X, y):
 
     return p_values
 
-def snp_linreg_pvalues(X, y):
+def batched_snp_linreg_tests(X, y):
+    """
+    Likelihood ratio tests for a stack of one-hot genotype matrices X
+    (n_snps, n_samples, 3) against the response y.  Returns the SNP
+    p-values and the predicted response for each genotype.
+
+    Unknown genotypes are weighted as in upsample_features(weighted=True).
+    Since the genotypes are one-hot, the least squares fits are the
+    weighted means of each genotype and no expanded matrices are built.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n_snps, n_samples, n_genotypes = X.shape
+
+    unknown = (X.sum(axis=2) == 0).astype(np.float64)
+    weights = X.sum(axis=1) + unknown.sum(axis=1)[:, np.newaxis] / n_genotypes
+    sums = X.transpose(0, 2, 1) @ y + (unknown @ y)[:, np.newaxis] / n_genotypes
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gt_pred_ys = np.where(weights > 0, sums / weights, 0.0)
+
+    known_error = (y - (X @ gt_pred_ys[:, :, np.newaxis])[:, :, 0]) * (1.0 - unknown)
+    imputed_error = ((y - gt_pred_ys[:, :, np.newaxis]) ** 2).mean(axis=1)
+    alt_error2 = (known_error ** 2).sum(axis=1) + (unknown * imputed_error).sum(axis=1)
+
+    diff = y - np.mean(y)
+    null_error2 = np.dot(diff, diff)
+    sigma2 = null_error2 / (n_samples - 1)
+
+    G = (null_error2 - alt_error2) / sigma2
+    snp_p_values = np.maximum(1e-300, chi2.sf(G, n_genotypes - 1))
+
+    return snp_p_values, gt_pred_ys
+
+def snp_linreg_pvalues(X, y, solver=SGD_SOLVER, weighted=False):
+    """
+    With the SGD solver, weighted selects the weighted-sample form of
+    the imputed genotypes instead of one copy of each sample per
+    genotype.  The exact solver always uses the weighted form.
+    """
     N_GENOTYPES = 3
-    n_iter = estimate_lr_iter(len(y))
-
-    adj_y, adj_X = upsample_features(y, X)
-    g_scaling_factor = 1.0 / N_GENOTYPES
 
-    snp_p_value, model = lin_reg_lrtest(adj_X,
-                                        adj_y,
-                                        n_iter,
-                                        g_scaling_factor=g_scaling_factor)
+    if solver == EXACT_SOLVER:
+        snp_p_values, gt_pred_ys = batched_snp_linreg_tests(X[np.newaxis, :, :], y)
+        snp_p_value = snp_p_values[0]
+        gt_pred_ys = gt_pred_ys[0]
+    elif solver == SGD_SOLVER:
+        n_iter = estimate_lr_iter(len(y))
+
+        if weighted:
+            adj_y, adj_X, sample_weight = upsample_features(y, X, weighted=True)
+            g_scaling_factor = 1.0
+        else:
+            adj_y, adj_X = upsample_features(y, X)
+            sample_weight = None
+            g_scaling_factor = 1.0 / N_GENOTYPES
+
+        snp_p_value, model = lin_reg_lrtest(adj_X,
+                                            adj_y,
+                                            n_iter,
+                                            g_scaling_factor=g_scaling_factor,
+                                            sample_weight=sample_weight)
+
+        gt_pred_ys = model.predict(np.eye(N_GENOTYPES))
+    else:
+        raise Exception("Unknown solver '%s'" % solver)
 
-    gt_pred_ys = model.predict(np.eye(N_GENOTYPES))
     gt_ttest_pvalues = genotype_ttest(X, y)
     gt_normality_pvalues = genotype_normality_test(X, y)
 
     return snp_p_value, gt_ttest_pvalues, gt_normality_pvalues, gt_pred_ys
 
-def likelihood_ratio_test(features_alternate, labels, lr_model, set_intercept=True, g_scaling_factor=1.0):
+HOMO_REF_CATEGORY = 0
+HOMO_ALT_CATEGORY = 1
+HET_CATEGORY = 2
+N_GENOTYPE_CATEGORIES = 3
+
+def genotype_categories(genotypes):
+    """
+    Converts an (n_variants, n_samples, 2) array of (ref_count, alt_count)
+    pairs to an (n_variants, n_samples) array of genotype categories.
+    Unknown and partially-known genotypes are marked with -1.
+    """
+    ref_counts = genotypes[:, :, 0]
+    alt_counts = genotypes[:, :, 1]
+
+    categories = np.full(ref_counts.shape, -1, dtype=np.int8)
+    categories[(ref_counts == 2) & (alt_counts == 0)] = HOMO_REF_CATEGORY
+    categories[(ref_counts == 0) & (alt_counts == 2)] = HOMO_ALT_CATEGORY
+    categories[(ref_counts == 1) & (alt_counts == 1)] = HET_CATEGORY
+
+    return categories
+
+def _all_groups_constant(groups):
+    all_const = all(np.all(group == group[0]) for group in groups)
+    values = np.concatenate(groups)
+    all_same = np.all(values == values[0])
+
+    return all_const, all_same
+
+def batched_anova_pvalues(categories, coordinates, n_groups=N_GENOTYPE_CATEGORIES):
+    """
+    One-way ANOVA of each column of coordinates (n_samples, n_components)
+    across the groups given by each row of categories (n_variants,
+    n_samples).  Samples with a negative category are left out.
+
+    Returns an (n_variants, n_components) array of p-values that match
+    scipy.stats.f_oneway run on the non-empty groups.  Tests where
+    f_oneway is undefined (fewer than two groups, no degrees of freedom
+    within groups, or all values equal) get a p-value of 1.
+    """
+    coordinates = np.asarray(coordinates, dtype=np.float64)
+    one_hot = (categories[:, :, np.newaxis] == np.arange(n_groups)).astype(np.float64)
+
+    # (n_variants, n_groups) and (n_variants, n_groups, n_components)
+    counts = one_hot.sum(axis=1)
+    sums = one_hot.transpose(0, 2, 1) @ coordinates
+    squares = one_hot.transpose(0, 2, 1) @ (coordinates ** 2)
+
+    n_total = counts.sum(axis=1)[:, np.newaxis]
+    n_present = (counts > 0).sum(axis=1)
+    df_between = (n_present - 1)[:, np.newaxis]
+    df_within = n_total - n_present[:, np.newaxis]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # center on the mean of the tested samples like f_oneway does
+        offset = sums.sum(axis=1) / n_total
+        centered_sums = sums - counts[:, :, np.newaxis] * offset[:, np.newaxis, :]
+        centered_total = centered_sums.sum(axis=1)
+        normalized_ss = centered_total ** 2 / n_total
+
+        ss_total = squares.sum(axis=1) - 2.0 * offset * sums.sum(axis=1) \
+            + n_total * offset ** 2 - normalized_ss
+        group_ss = np.where(counts[:, :, np.newaxis] > 0,
+                            centered_sums ** 2 / counts[:, :, np.newaxis],
+                            0.0)
+        ss_between = group_ss.sum(axis=1) - normalized_ss
+        ss_within = ss_total - ss_between
+
+        f_statistics = (ss_between / df_between) / (ss_within / df_within)
+        pvalues = fdtrc(df_between, df_within, f_statistics)
+
+    testable = (df_between > 0) & (df_within > 0)
+    pvalues = np.where(testable & ~np.isnan(pvalues), pvalues, 1.0)
+
+    # f_oneway treats groups with identical values specially.  The
+    # sums of squares cannot tell exactly constant groups apart from
+    # nearly constant ones, so look at the values for those tests.
+    nearly_constant = testable & (ss_within <= 1e-10 * np.maximum(squares.sum(axis=1), 1e-300))
+    for variant_idx, component_idx in zip(*np.nonzero(nearly_constant)):
+        values = coordinates[:, component_idx]
+        groups = [values[categories[variant_idx] == group]
+                  for group in range(n_groups)
+                  if counts[variant_idx, group] > 0]
+        all_const, all_same = _all_groups_constant(groups)
+        if all_const:
+            pvalues[variant_idx, component_idx] = 1.0 if all_same else 0.0
+
+    return pvalues
+
+def feature_anova_pvalues(features, labels, block_size=4096):
+    """
+    One-way ANOVA of each column of an integer feature matrix (n_samples,
+    n_features) across the groups of samples given by labels.  The
+    columns are processed in blocks to bound the memory of the floating
+    point copies.
+
+    Returns an array of p-values that match scipy.stats.f_oneway.
+    Features that are constant within every group are untestable and get
+    a p-value of NaN.
+    """
+    labels = np.asarray(labels)
+    group_labels = np.unique(labels)
+    one_hot = (labels[np.newaxis, :] == group_labels[:, np.newaxis]).astype(np.float64)
+
+    # (n_groups, 1)
+    counts = one_hot.sum(axis=1)[:, np.newaxis]
+    n_total = counts.sum()
+    df_between = len(group_labels) - 1
+    df_within = n_total - len(group_labels)
+
+    pvalues = np.empty(features.shape[1])
+    for start in range(0, features.shape[1], block_size):
+        block = np.asarray(features[:, start:start + block_size], dtype=np.float64)
+
+        # sums of small integers are exact, so the
+        # constant groups can be found exactly
+        sums = one_hot @ block
+        squares = one_hot @ (block ** 2)
+        all_constant = np.all(counts * squares == sums ** 2, axis=0)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # equal group means can cancel to slightly below 0
+            ss_between = np.maximum((sums ** 2 / counts).sum(axis=0) - sums.sum(axis=0) ** 2 / n_total,
+                                    0.0)
+            ss_within = (squares - sums ** 2 / counts).sum(axis=0)
+
+            f_statistics = (ss_between / df_between) / (ss_within / df_within)
+            block_pvalues = fdtrc(df_between, df_within, f_statistics)
+
+        block_pvalues[all_constant] = np.nan
+        pvalues[start:start + block.shape[1]] = block_pvalues
+
+    return pvalues
+
+def batched_chi2_contingency_pvalues(observed):
+    """
+    Chi-squared tests of independence for a stack of (n_rows, n_columns)
+    contingency tables given as an (n_tables, n_rows, n_columns) array.
+
+    Returns an array of p-values that match scipy.stats.chi2_contingency
+    with its default Yates' correction for tables with one degree of
+    freedom.  Tables without degrees of freedom or with a zero expected
+    frequency (which chi2_contingency rejects) get a p-value of 1.
+    """
+    observed = np.asarray(observed, dtype=np.float64)
+    _, n_rows, n_columns = observed.shape
+    dof = (n_rows - 1) * (n_columns - 1)
+
+    if dof == 0:
+        return np.ones(observed.shape[0])
+
+    row_sums = observed.sum(axis=2, keepdims=True)
+    column_sums = observed.sum(axis=1, keepdims=True)
+    totals = observed.sum(axis=(1, 2), keepdims=True)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        expected = row_sums * column_sums / totals
+
+        if dof == 1:
+            diff = expected - observed
+            observed = observed + np.minimum(0.5, np.abs(diff)) * np.sign(diff)
+
+        statistics = ((observed - expected) ** 2 / expected).sum(axis=(1, 2))
+
+    pvalues = chi2.sf(statistics, dof)
+
+    valid = np.all(expected != 0, axis=(1, 2)) & np.isfinite(pvalues)
+
+    return np.where(valid, pvalues, 1.0)
+
+def _split_training_testing(features_alternate, labels):
     if isinstance(features_alternate, tuple) and len(features_alternate) == 2:
         training_features, testing_features = features_alternate
         training_labels, testing_labels = labels
@@ -158,12 +420,111 @@ def likelihood_ratio_test(features_alternate, labels, lr_model, set_intercept=Tr
         training_labels = labels
         testing_labels = labels
 
+    return training_features, testing_features, training_labels, testing_labels
+
+def _binary_log_likelihood(y, prob):
+    prob = np.clip(prob, 1e-15, 1.0 - 1e-15)
+    return (y * np.log(prob) + (1.0 - y) * np.log(1.0 - prob)).sum(axis=-1)
+
+def batched_logistic_regression(X, y, intercept_init=0.0, max_iter=DEFAULT_IRLS_ITER, tol=1e-8):
+    """
+    Fits unpenalized logistic regression models with an intercept to a
+    stack of design matrices X (n_models, n_samples, n_features) sharing
+    the binary labels y using Newton's method (IRLS).
+
+    Returns the (n_models, n_features + 1) coefficients with the
+    intercepts in the first column.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    n_models, n_samples, _ = X.shape
+    X = np.concatenate([np.ones((n_models, n_samples, 1)), X], axis=2)
+    Xt = X.transpose(0, 2, 1)
+
+    coefficients = np.zeros((n_models, X.shape[2]))
+    coefficients[:, 0] = intercept_init
+
+    for _ in range(max_iter):
+        prob = expit((X @ coefficients[:, :, np.newaxis])[:, :, 0])
+        weights = prob * (1.0 - prob)
+
+        gradient = Xt @ (y - prob)[:, :, np.newaxis]
+        hessian = Xt @ (weights[:, :, np.newaxis] * X)
+
+        # pinv handles collinear features such as a complete
+        # set of one-hot genotypes alongside the intercept
+        step = (np.linalg.pinv(hessian) @ gradient)[:, :, 0]
+        coefficients += step
+
+        if np.max(np.abs(step)) < tol:
+            break
+
+    return coefficients
+
+def batched_likelihood_ratio_tests(features_alternate, labels, g_scaling_factor=1.0, max_iter=DEFAULT_IRLS_ITER):
+    """
+    Exact counterpart of likelihood_ratio_test for a stack of feature
+    matrices (n_models, n_samples, n_features) sharing the labels.  As
+    with likelihood_ratio_test, a (training, testing) pair of feature
+    stacks and labels can be given instead.
+
+    The null model is fit in closed form and the alternative models
+    with batched_logistic_regression.  Returns an array of p-values.
+    """
+    training_features, testing_features, training_labels, testing_labels = \
+        _split_training_testing(features_alternate, labels)
+
+    classes = np.unique(training_labels)
+    if len(classes) > 2:
+        raise Exception("Exact likelihood ratio tests require binary labels")
+    training_y = (np.asarray(training_labels) == classes[-1]).astype(np.float64)
+    testing_y = (np.asarray(testing_labels) == classes[-1]).astype(np.float64)
+
+    # maximum likelihood estimate of the intercept-only model
+    null_prob = np.clip(training_y.mean(), 1e-15, 1.0 - 1e-15)
+    null_log_likelihood = _binary_log_likelihood(testing_y, null_prob)
+
+    coefficients = batched_logistic_regression(training_features,
+                                               training_y,
+                                               intercept_init=np.log(null_prob / (1.0 - null_prob)),
+                                               max_iter=max_iter)
+
+    testing_features = np.asarray(testing_features, dtype=np.float64)
+    alt_prob = expit(coefficients[:, np.newaxis, 0] +
+                     (testing_features @ coefficients[:, 1:, np.newaxis])[:, :, 0])
+    alt_log_likelihood = _binary_log_likelihood(testing_y, alt_prob)
+
+    G = g_scaling_factor * 2.0 * (alt_log_likelihood - null_log_likelihood)
+
+    # both models have intercepts so the intercepts cancel out
+    df = testing_features.shape[2]
+
+    return chi2.sf(G, df)
+
+def likelihood_ratio_test(features_alternate, labels, lr_model, set_intercept=True, g_scaling_factor=1.0, solver=SGD_SOLVER):
+    """
+    With the exact solver, lr_model is not used and may be None.
+    """
+    if solver == EXACT_SOLVER:
+        if isinstance(features_alternate, tuple) and len(features_alternate) == 2:
+            stacked = tuple(features[np.newaxis, :, :] for features in features_alternate)
+        else:
+            stacked = features_alternate[np.newaxis, :, :]
+
+        return batched_likelihood_ratio_tests(stacked,
+                                              labels,
+                                              g_scaling_factor=g_scaling_factor)[0]
+    elif solver != SGD_SOLVER:
+        raise Exception("Unknown solver '%s'" % solver)
+
+    training_features, testing_features, training_labels, testing_labels = \
+        _split_training_testing(features_alternate, labels)
+
     n_training_samples = training_features.shape[0]
     n_testing_samples = testing_features.shape[0]
     n_iter = estimate_lr_iter(n_testing_samples)
 
     # null model
-    null_lr = SGDClassifier(loss = "log",
+    null_lr = SGDClassifier(loss = "log_loss",
                             fit_intercept = False,
                             max_iter = n_iter)
     null_training_X = np.ones((n_training_samples, 1))
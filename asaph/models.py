@@ -1,7 +1,8 @@
 """
 This module defines data structures and named tuples for representing project summaries,
 including feature counts, sample information, and dimensionality reduction parameters
-for population genetics analysis workflows.
+for population genetics analysis workflows, as well as the blocks of variants and
+features passed between the stages of the import pipeline.
 
 Copyright 2015 Ronald J. Nowling
 
@@ -27,3 +28,45 @@ ProjectSummary = namedtuple("ProjectSummary",
                              "sampling_method",
                              "sample_names",
                              "explained_variance_ratios"])
+
+# A chunk of consecutive variants.  chromosomes, positions, ref_alleles,
+# and alt_alleles are arrays of length n_variants and genotypes is an
+# int8 array of shape (n_variants, n_samples, 2) of (ref_count, alt_count)
+# pairs.
+VariantBlock = namedtuple("VariantBlock",
+                          ["chromosomes",
+                           "positions",
+                           "ref_alleles",
+                           "alt_alleles",
+                           "genotypes"])
+
+# A chunk of consecutive feature columns.  labels is a list of
+# (chromosome, position, genotype) triplets and columns is a uint8
+# array of shape (n_samples, n_features).
+FeatureBlock = namedtuple("FeatureBlock",
+                          ["labels",
+                           "columns"])
+
+# Identifies the columns of a feature matrix so that the same features
+# can be built for other samples or re-read from the kept variants only.
+# For explicitly kept features, keys is the name of the feature in each
+# column and chromosomes and positions give its variant.  With feature
+# hashing, buckets is the hash bucket of each column and n_buckets is the
+# number of buckets the features were hashed into.  Every feature is
+# re-hashed with hash_seed, so the index does not grow with the number
+# of features and hashes is None.  signed_hashing is True if each
+# feature was added with the sign of its hash.  For
+# bottom-k sketches, hashes holds the (absolute) hash of each
+# column and sketch_size is the number of features the sketch could hold.
+# hash_seed and random_seed are the seeds used to select the features.
+FeatureIndex = namedtuple("FeatureIndex",
+                          ["keys",
+                           "chromosomes",
+                           "positions",
+                           "buckets",
+                           "n_buckets",
+                           "hashes",
+                           "signed_hashing",
+                           "sketch_size",
+                           "hash_seed",
+                           "random_seed"])
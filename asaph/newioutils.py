@@ -18,20 +18,34 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import json
 import pickle
 from collections import OrderedDict
 import os
 
+import numpy as np
+from scipy.sparse import issparse
+from scipy.sparse import load_npz
+from scipy.sparse import save_npz
+
 from .models import *
 
 
 SAMPLE_LABELS_FLNAME = "sample_labels"
 MODEL_FLNAME = "model"
 MODEL_KEY = "pca"
-PROJECT_SUMMARY_FLNAME = "project_summary"
+PROJECT_SUMMARY_FLNAME = "project_summary.json"
 PROJECTION_KEY = "projected-coordinates"
-FEATURES_FLNAME = "features"
+FEATURES_FLNAME = "features.npy"
+SPARSE_FEATURES_FLNAME = "features.npz"
+FEATURE_INDEX_FLNAME = "feature_index.npz"
+GRAM_FLNAME = "gram.npz"
+
+# pickled files written by older versions
+LEGACY_PROJECT_SUMMARY_FLNAME = "project_summary"
+LEGACY_FEATURES_FLNAME = "features"
 COORDINATES_FLNAME = "pca_coordinates.tsv"
+GENOTYPE_STORE_DIRNAME = "genotype_store"
 
 def read_populations(flname):
     """
@@ -57,6 +71,13 @@ def read_populations(flname):
 
     return groups, group_names
 
+def read_selected_samples(flname):
+    """
+    Reads a list of sample names from a file with one
+    (or more whitespace-separated) sample names per line.
+    """
+    with open(flname, encoding="utf-8") as fl:
+        return [name for ln in fl for name in ln.split()]
 
 def serialize(flname, obj):
     with open(flname, "wb") as fl:
@@ -71,3 +92,118 @@ def deserialize(flname):
 def read_sample_names(workdir):
     sample_labels = deserialize(os.path.join(workdir, SAMPLE_LABELS_FLNAME))
     return sample_labels
+
+
+def write_project_summary(workdir, project_summary):
+    summary = project_summary._asdict()
+    if summary["explained_variance_ratios"] is not None:
+        summary["explained_variance_ratios"] = list(map(float, summary["explained_variance_ratios"]))
+
+    with open(os.path.join(workdir, PROJECT_SUMMARY_FLNAME), "wt", encoding="utf-8") as fl:
+        json.dump(summary, fl)
+
+def read_project_summary(workdir):
+    """
+    Reads the project summary from the JSON sidecar, falling back to the
+    pickled summary written by older versions.
+    """
+    flname = os.path.join(workdir, PROJECT_SUMMARY_FLNAME)
+    if not os.path.exists(flname):
+        legacy_flname = os.path.join(workdir, LEGACY_PROJECT_SUMMARY_FLNAME)
+        if os.path.exists(legacy_flname):
+            return deserialize(legacy_flname)
+
+    with open(flname, "rt", encoding="utf-8") as fl:
+        summary = json.load(fl)
+
+    if summary["explained_variance_ratios"] is not None:
+        summary["explained_variance_ratios"] = np.array(summary["explained_variance_ratios"])
+
+    return ProjectSummary(**summary)
+
+def remove_stale_files(workdir, flnames):
+    """
+    Removes files written to the workdir by an earlier run that would
+    otherwise be read in place of the current results.
+    """
+    for flname in flnames:
+        path = os.path.join(workdir, flname)
+        if os.path.exists(path):
+            os.remove(path)
+
+def write_features(workdir, feature_matrix):
+    # read_features prefers the sparse matrix, so the
+    # other form must not be left from an earlier run
+    if issparse(feature_matrix):
+        save_npz(os.path.join(workdir, SPARSE_FEATURES_FLNAME),
+                 feature_matrix,
+                 compressed=False)
+        remove_stale_files(workdir, [FEATURES_FLNAME, LEGACY_FEATURES_FLNAME])
+    else:
+        np.save(os.path.join(workdir, FEATURES_FLNAME), feature_matrix)
+        remove_stale_files(workdir, [SPARSE_FEATURES_FLNAME, LEGACY_FEATURES_FLNAME])
+
+def read_features(workdir, mmap_mode="r"):
+    """
+    Opens the (n_samples, n_features) feature matrix.  By default, the
+    matrix is memory mapped so only the rows or columns that are accessed
+    are read from disk.  Sparse feature matrices are loaded into memory.
+    """
+    sparse_flname = os.path.join(workdir, SPARSE_FEATURES_FLNAME)
+    if os.path.exists(sparse_flname):
+        return load_npz(sparse_flname)
+
+    flname = os.path.join(workdir, FEATURES_FLNAME)
+    if not os.path.exists(flname):
+        legacy_flname = os.path.join(workdir, LEGACY_FEATURES_FLNAME)
+        if os.path.exists(legacy_flname):
+            return deserialize(legacy_flname)
+
+    return np.load(flname, mmap_mode=mmap_mode)
+
+def write_feature_index(workdir, feature_index):
+    arrays = { "hash_seed" : np.array(feature_index.hash_seed) }
+    if feature_index.random_seed is not None:
+        arrays["random_seed"] = np.array(feature_index.random_seed)
+    if feature_index.keys is not None:
+        arrays["keys"] = np.array(feature_index.keys, dtype=str)
+        arrays["chromosomes"] = np.array(feature_index.chromosomes, dtype=str)
+        arrays["positions"] = np.array(feature_index.positions, dtype=np.int64)
+    if feature_index.buckets is not None:
+        arrays["buckets"] = feature_index.buckets
+        arrays["n_buckets"] = np.array(feature_index.n_buckets)
+        arrays["signed_hashing"] = np.array(feature_index.signed_hashing)
+    if feature_index.hashes is not None:
+        arrays["hashes"] = feature_index.hashes
+    if feature_index.sketch_size is not None:
+        arrays["sketch_size"] = np.array(feature_index.sketch_size)
+
+    np.savez(os.path.join(workdir, FEATURE_INDEX_FLNAME), **arrays)
+
+def read_feature_index(workdir):
+    """
+    Reads the index of the feature matrix columns.  Returns None for
+    projects that were created without one.
+    """
+    flname = os.path.join(workdir, FEATURE_INDEX_FLNAME)
+    if not os.path.exists(flname):
+        return None
+
+    with np.load(flname) as arrays:
+        def get(name, convert=None):
+            if name not in arrays:
+                return None
+            if convert is None:
+                return arrays[name]
+            return convert(arrays[name])
+
+        return FeatureIndex(keys=get("keys", lambda keys: keys.tolist()),
+                            chromosomes=get("chromosomes", lambda chroms: chroms.tolist()),
+                            positions=get("positions"),
+                            buckets=get("buckets"),
+                            n_buckets=get("n_buckets", int),
+                            hashes=get("hashes"),
+                            signed_hashing=get("signed_hashing", bool) or False,
+                            sketch_size=get("sketch_size", int),
+                            hash_seed=get("hash_seed", int) or 0,
+                            random_seed=get("random_seed", int))
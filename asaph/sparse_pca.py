@@ -0,0 +1,126 @@
+"""
+This module provides a PCA solver for sparse feature matrices, such as the one-hot
+genotype category features.  The columns are centered implicitly inside the matrix
+products of a truncated SVD, so the feature matrix is never densified.
+
+Copyright 2015 Ronald J. Nowling
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+from scipy.sparse import csc_matrix
+from scipy.sparse.linalg import LinearOperator
+from scipy.sparse.linalg import svds
+
+SPARSE_SOLVER = "sparse"
+
+def centered_operator(features, means):
+    """
+    Returns a LinearOperator that multiplies by features - means without
+    forming the centered matrix.
+    """
+    n_samples, n_features = features.shape
+
+    def matmat(x):
+        return features @ x - np.outer(np.ones(n_samples), means @ x)
+
+    def rmatmat(y):
+        return features.T @ y - np.outer(means, y.sum(axis=0))
+
+    return LinearOperator((n_samples, n_features),
+                          matvec=lambda x: matmat(x.reshape(-1, 1)).ravel(),
+                          rmatvec=lambda y: rmatmat(y.reshape(-1, 1)).ravel(),
+                          matmat=matmat,
+                          rmatmat=rmatmat,
+                          dtype=np.float64)
+
+class SparseInputPCA:
+    """
+    Truncated PCA of a (n_samples, n_features) sparse matrix using ARPACK
+    with implicit mean centering.  Like sklearn.decomposition.PCA(whiten=True),
+    fit_transform() and transform() return whitened projections, so the
+    model can project new samples.
+    """
+    def __init__(self, n_components, random_state=0):
+        self.n_components = n_components
+        self.random_state = random_state
+        self.n_components_ = None
+        self.n_samples_ = None
+        self.n_features_ = None
+        self.mean_ = None
+        self.components_ = None
+        self.singular_values_ = None
+        self.explained_variance_ = None
+        self.explained_variance_ratio_ = None
+
+    def fit_transform(self, features):
+        # each sparse product would upcast compact (e.g., uint8) values
+        # to a new float64 copy, so convert them once and share the indices
+        features = csc_matrix(features)
+        features = csc_matrix((features.data.astype(np.float64),
+                               features.indices,
+                               features.indptr),
+                              shape=features.shape,
+                              copy=False)
+        n_samples, n_features = features.shape
+
+        self.n_samples_ = n_samples
+        self.n_features_ = n_features
+        # sparse mean() makes temporary copies of the matrix
+        self.mean_ = features.T @ np.ones(n_samples) / n_samples
+
+        total_variance = (features.data @ features.data - n_samples * self.mean_ @ self.mean_) \
+            / (n_samples - 1)
+
+        # ARPACK needs fewer singular vectors than the smaller dimension
+        n_components = min(self.n_components, min(n_samples, n_features) - 1)
+        rng = np.random.default_rng(self.random_state)
+        v0 = rng.uniform(-1.0, 1.0, min(n_samples, n_features))
+        u, s, vt = svds(centered_operator(features, self.mean_),
+                        k=n_components,
+                        v0=v0)
+
+        order = np.argsort(s)[::-1]
+        u = u[:, order]
+        s = s[order]
+        vt = vt[order]
+
+        # make the largest entry of each sample vector positive
+        # so the results are deterministic, like sklearn's svd_flip
+        max_abs_rows = np.argmax(np.abs(u), axis=0)
+        signs = np.sign(u[max_abs_rows, range(u.shape[1])])
+        signs[signs == 0] = 1.0
+        u *= signs
+        vt *= signs[:, np.newaxis]
+
+        self.n_components_ = n_components
+        self.components_ = vt
+        self.singular_values_ = s
+        self.explained_variance_ = s ** 2 / (n_samples - 1)
+        self.explained_variance_ratio_ = self.explained_variance_ / total_variance
+
+        return u * np.sqrt(n_samples - 1)
+
+    def fit(self, features):
+        self.fit_transform(features)
+
+        return self
+
+    def transform(self, features):
+        """
+        Projects dense or sparse features of new samples.
+        """
+        projected = features @ self.components_.T - self.mean_ @ self.components_.T
+
+        return np.asarray(projected) / np.sqrt(self.explained_variance_)
@@ -0,0 +1,303 @@
+"""
+This module provides PCA solvers that are fit from a stream of feature column blocks
+instead of a fully materialized feature matrix.  Only arrays with one row per sample
+and a small number of columns are kept in memory, so the number of features is not
+limited by the available memory.
+
+Copyright 2015 Ronald J. Nowling
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+
+INCREMENTAL_SOLVER = "incremental"
+RANDOMIZED_SOLVER = "randomized"
+GRAM_SOLVER = "gram"
+
+DEFAULT_OVERSAMPLES = 10
+
+def _center(columns):
+    columns = np.asarray(columns, dtype=np.float64)
+    return columns - columns.mean(axis=0)
+
+def _flip_signs(u):
+    # make the largest entry of each singular vector positive
+    # so the results are deterministic, like sklearn's svd_flip
+    max_abs_rows = np.argmax(np.abs(u), axis=0)
+    signs = np.sign(u[max_abs_rows, range(u.shape[1])])
+    signs[signs == 0] = 1.0
+    return u * signs
+
+class StreamingPCA:
+    """
+    Base class for the streaming solvers.  Features are the columns of the
+    (n_samples, n_features) matrix and are centered block by block.  After
+    fitting, the left singular vectors (one row per sample) give the
+    projections of the samples.
+
+    fit() takes a function that returns a new iterable of
+    (n_samples, n_block_features) arrays each time it is called.
+
+    Since the features are streamed, the components in feature space are
+    not stored.
+    """
+    def __init__(self, n_components):
+        self.n_components = n_components
+        self.n_components_ = None
+        self.n_samples_ = None
+        self.n_features_ = 0
+        self.total_variance_ = 0.0
+        self.singular_values_ = None
+        self.explained_variance_ = None
+        self.explained_variance_ratio_ = None
+        self.left_singular_vectors_ = None
+
+    def _observe(self, columns):
+        centered = _center(columns)
+        self.n_samples_ = centered.shape[0]
+        self.n_features_ += centered.shape[1]
+        self.total_variance_ += (centered ** 2).sum() / (self.n_samples_ - 1)
+
+        return centered
+
+    def _finalize(self, u, s):
+        n_components = min(self.n_components, len(s))
+        u = _flip_signs(u[:, :n_components])
+        s = s[:n_components]
+
+        self.n_components_ = n_components
+        self.left_singular_vectors_ = u
+        self.singular_values_ = s
+        self.explained_variance_ = s ** 2 / (self.n_samples_ - 1)
+        self.explained_variance_ratio_ = self.explained_variance_ / self.total_variance_
+
+    def fit(self, column_blocks):
+        raise NotImplementedError()
+
+    def fit_transform(self, column_blocks):
+        """
+        Fits the model and returns the whitened projections of the samples,
+        which match sklearn.decomposition.PCA(whiten=True) up to the signs
+        of the components.
+        """
+        self.fit(column_blocks)
+
+        return self.sample_projections()
+
+    def sample_projections(self):
+        return self.left_singular_vectors_ * np.sqrt(self.n_samples_ - 1)
+
+class IncrementalPCA(StreamingPCA):
+    """
+    Single-pass solver.  Keeps a truncated SVD of the columns seen so far
+    and updates it with each block of columns (Brand's incremental SVD).
+    A few more singular vectors than requested are kept between updates
+    to limit the truncation error.
+    """
+    def __init__(self, n_components, n_oversamples=DEFAULT_OVERSAMPLES, batch_size=None):
+        super().__init__(n_components)
+        self.n_oversamples = n_oversamples
+
+        # updates are cheapest when the number of new columns
+        # is similar to the rank of the kept decomposition
+        if batch_size is None:
+            batch_size = max(n_components + n_oversamples, 32)
+        self.batch_size = batch_size
+
+    def _update(self, u, s, centered, rank):
+        if u is None:
+            q, r = np.linalg.qr(centered)
+            u_r, s, _ = np.linalg.svd(r, full_matrices=False)
+            u = q @ u_r
+        else:
+            # project the new columns onto the current basis
+            # and orthogonalize the residual
+            projected = u.T @ centered
+            residual = centered - u @ projected
+            q, r = np.linalg.qr(residual)
+
+            k = len(s)
+            middle = np.zeros((k + r.shape[0], k + centered.shape[1]))
+            middle[:k, :k] = np.diag(s)
+            middle[:k, k:] = projected
+            middle[k:, k:] = r
+
+            u_m, s, _ = np.linalg.svd(middle, full_matrices=False)
+            u = np.hstack([u, q]) @ u_m
+
+        return u[:, :rank], s[:rank]
+
+    def fit(self, column_blocks):
+        u = None
+        s = None
+        for columns in column_blocks():
+            centered = self._observe(columns)
+            rank = min(self.n_samples_, self.n_components + self.n_oversamples)
+            for start in range(0, centered.shape[1], self.batch_size):
+                u, s = self._update(u,
+                                    s,
+                                    centered[:, start:start + self.batch_size],
+                                    rank)
+
+        if u is None:
+            raise Exception("Cannot fit PCA without any features")
+
+        self._finalize(u, s)
+
+        return self
+
+class RandomizedPCA(StreamingPCA):
+    """
+    Multi-pass randomized range finder (Halko et al.).  The first pass
+    multiplies the centered matrix by a random Gaussian matrix, each
+    power iteration and the final pass multiply by X X^T.  The SVD is
+    then recovered from a small (n_components + n_oversamples) square
+    matrix.
+    """
+    def __init__(self, n_components, n_power_iterations=2, n_oversamples=DEFAULT_OVERSAMPLES, random_state=None):
+        super().__init__(n_components)
+        self.n_power_iterations = n_power_iterations
+        self.n_oversamples = n_oversamples
+        self.random_state = random_state
+
+    def _multiply_gram(self, column_blocks, q):
+        product = np.zeros_like(q)
+        for columns in column_blocks():
+            centered = _center(columns)
+            product += centered @ (centered.T @ q)
+
+        return product
+
+    def fit(self, column_blocks):
+        rng = np.random.default_rng(self.random_state)
+
+        sketch = None
+        for columns in column_blocks():
+            centered = self._observe(columns)
+            if sketch is None:
+                n_random = min(self.n_samples_, self.n_components + self.n_oversamples)
+                sketch = np.zeros((self.n_samples_, n_random))
+            sketch += centered @ rng.standard_normal((centered.shape[1], sketch.shape[1]))
+
+        if sketch is None:
+            raise Exception("Cannot fit PCA without any features")
+
+        for _ in range(self.n_power_iterations):
+            q, _ = np.linalg.qr(sketch)
+            sketch = self._multiply_gram(column_blocks, q)
+
+        q, _ = np.linalg.qr(sketch)
+        small = q.T @ self._multiply_gram(column_blocks, q)
+        small = (small + small.T) / 2.0
+
+        eigenvalues, eigenvectors = np.linalg.eigh(small)
+        order = np.argsort(eigenvalues)[::-1]
+        s = np.sqrt(np.maximum(eigenvalues[order], 0.0))
+
+        self._finalize(q @ eigenvectors[:, order], s)
+
+        return self
+
+class GramAccumulator:
+    """
+    Accumulates the (n_samples, n_samples) Gram matrix of the centered
+    feature columns.  Each column is centered by its own mean, so the
+    contributions of separate sets of features (e.g., chromosomes) simply
+    add up and accumulators can be saved and merged.
+    """
+    def __init__(self):
+        self.gram = None
+        self.n_features = 0
+
+    def update(self, columns):
+        centered = _center(columns)
+        if self.gram is None:
+            self.gram = np.zeros((centered.shape[0], centered.shape[0]))
+        self.gram += centered @ centered.T
+        self.n_features += centered.shape[1]
+
+    def merge(self, other):
+        if other.gram is None:
+            return
+        if self.gram is None:
+            self.gram = np.zeros_like(other.gram)
+        elif self.gram.shape != other.gram.shape:
+            raise Exception("Cannot merge Gram matrices for different numbers of samples")
+
+        self.gram += other.gram
+        self.n_features += other.n_features
+
+def write_gram_accumulator(flname, accumulator):
+    np.savez(flname,
+             gram=accumulator.gram,
+             n_features=np.array(accumulator.n_features))
+
+def read_gram_accumulator(flname):
+    accumulator = GramAccumulator()
+    with np.load(flname) as arrays:
+        accumulator.gram = arrays["gram"]
+        accumulator.n_features = int(arrays["n_features"])
+
+    return accumulator
+
+class GramPCA(StreamingPCA):
+    """
+    Single-pass solver for data sets with many more features than
+    samples.  Accumulates the centered Gram matrix X X^T, whose
+    eigenvectors and eigenvalues are the left singular vectors and the
+    squared singular values of the centered matrix.  The cost of the
+    eigendecomposition only depends on the number of samples.
+    """
+    def __init__(self, n_components):
+        super().__init__(n_components)
+        self.accumulator_ = None
+
+    def fit(self, column_blocks):
+        accumulator = GramAccumulator()
+        for columns in column_blocks():
+            accumulator.update(columns)
+
+        return self.fit_gram(accumulator)
+
+    def fit_gram(self, accumulator):
+        """
+        Fits the model from an accumulated (and possibly merged)
+        Gram matrix.
+        """
+        if accumulator.gram is None:
+            raise Exception("Cannot fit PCA without any features")
+
+        self.accumulator_ = accumulator
+        self.n_samples_ = accumulator.gram.shape[0]
+        self.n_features_ = accumulator.n_features
+        self.total_variance_ = np.trace(accumulator.gram) / (self.n_samples_ - 1)
+
+        eigenvalues, eigenvectors = np.linalg.eigh(accumulator.gram)
+        order = np.argsort(eigenvalues)[::-1]
+        s = np.sqrt(np.maximum(eigenvalues[order], 0.0))
+
+        self._finalize(eigenvectors[:, order], s)
+
+        return self
+
+def make_streaming_pca(solver, n_components, n_power_iterations=2):
+    if solver == INCREMENTAL_SOLVER:
+        return IncrementalPCA(n_components)
+    elif solver == GRAM_SOLVER:
+        return GramPCA(n_components)
+    elif solver == RANDOMIZED_SOLVER:
+        return RandomizedPCA(n_components,
+                             n_power_iterations=n_power_iterations)
+
+    raise Exception("Unknown PCA solver '%s'" % solver)
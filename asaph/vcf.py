@@ -20,14 +20,37 @@ limitations under the License.
 """
 
 import gzip
+import io
+import queue
+import sys
+import threading
 
+import numpy as np
+
+from .bgzf import fetch_region
+from .bgzf import is_bgzf
+from .bgzf import load_index
 from .newioutils import *
 from .models import ProjectSummary
+from .models import VariantBlock
 
 DEFAULT_COLUMNS = {'CHROM' : 0, 'POS' : 1, 'ID' : 2, 'REF' : 3, 'ALT' : 4, 'QUAL' : 5, 'FILTER' : 6, 'INFO' : 7, 'FORMAT' : 8}
 GENOTYPE_OFFSET = 9
 UNKNOWN_GENOTYPE = (0, 0)
 
+# number of VCF lines decoded together in batched mode
+DEFAULT_BLOCK_SIZE = 1024
+
+# size of the raw reads done by the prefetching reader and
+# the number of line batches it may get ahead of the parser
+PREFETCH_CHUNK_SIZE = 4 * 1024 * 1024
+PREFETCH_QUEUE_SIZE = 8
+
+TAB_BYTE = ord("\t")
+NEWLINE_BYTE = ord("\n")
+REF_BYTE = ord("0")
+ALT_BYTE = ord("1")
+
 ## Parsing
 def parse_vcf_line(ln, kept_pairs):
     """
@@ -71,8 +94,237 @@ def parse_vcf_line(ln, kept_pairs):
     variant_label = (cols[DEFAULT_COLUMNS["CHROM"]], cols[DEFAULT_COLUMNS["POS"]])
     return (variant_label, alleles, tuple(individual_genotypes))
 
+def _decode_genotypes_slow(lines, kept_indices):
+    """
+    Fallback for blocks whose lines do not have the expected number of
+    tab-separated columns (e.g., space-delimited files).
+    """
+    genotypes = np.zeros((len(lines), len(kept_indices), 2), dtype=np.int8)
+    for row_idx, ln in enumerate(lines):
+        cols = ln.split()
+        for i, idx in enumerate(kept_indices):
+            col = cols[GENOTYPE_OFFSET + idx]
+            genotypes[row_idx, i, 0] = (col[:1] == b"0") + (col[2:3] == b"0")
+            genotypes[row_idx, i, 1] = (col[:1] == b"1") + (col[2:3] == b"1")
+
+    return genotypes
+
+def decode_genotype_block(lines, n_columns, kept_indices):
+    """
+    Takes a list of VCF lines (as bytes), the number of columns in
+    each line, and the column indices (relative to the first genotype
+    column) of the individuals to keep.
+
+    Returns a VariantBlock.  genotypes is an int8 array of shape
+    (n_variants, n_individuals, 2) containing the (ref_count, alt_count)
+    of each individual.
+
+    The genotype columns are located with vectorized byte operations
+    over the whole block rather than by splitting each line.
+    """
+    chromosomes = np.empty(len(lines), dtype=object)
+    positions = np.empty(len(lines), dtype=np.int64)
+    ref_alleles = np.empty(len(lines), dtype=object)
+    alt_alleles = np.empty(len(lines), dtype=object)
+    for i, ln in enumerate(lines):
+        cols = ln.split(maxsplit=DEFAULT_COLUMNS["ALT"] + 1)
+        chromosomes[i] = cols[DEFAULT_COLUMNS["CHROM"]].decode("utf-8")
+        positions[i] = int(cols[DEFAULT_COLUMNS["POS"]])
+        ref_alleles[i] = cols[DEFAULT_COLUMNS["REF"]].decode("utf-8")
+        alt_alleles[i] = cols[DEFAULT_COLUMNS["ALT"]].decode("utf-8")
+
+    # make sure every line (including the last one in the file)
+    # is terminated so that each field has an end delimiter
+    buf = b"".join(ln if ln.endswith(b"\n") else ln + b"\n"
+                   for ln in lines)
+    arr = np.frombuffer(buf, dtype=np.uint8)
+
+    tabs = np.flatnonzero(arr == TAB_BYTE)
+    newlines = np.flatnonzero(arr == NEWLINE_BYTE)
+
+    tabs_per_line = np.diff(np.searchsorted(tabs, newlines), prepend=0)
+    if len(newlines) != len(lines) or np.any(tabs_per_line != n_columns - 1):
+        genotypes = _decode_genotypes_slow(lines, kept_indices)
+        return VariantBlock(chromosomes, positions, ref_alleles, alt_alleles, genotypes)
+
+    # field i of each line starts after tab i - 1 and ends
+    # at tab i (or the newline for the last field)
+    tabs = tabs.reshape(len(lines), n_columns - 1)
+    delimiters = np.hstack([tabs, newlines.reshape(-1, 1)])
+    kept_indices = np.asarray(kept_indices, dtype=np.int64)
+    starts = delimiters[:, GENOTYPE_OFFSET - 1 + kept_indices] + 1
+    ends = delimiters[:, GENOTYPE_OFFSET + kept_indices]
+
+    # avoid caring whether / or | is used as separator by indexing
+    # ignore unknown genotype (.)
+    first = arr[starts]
+    second = arr[np.minimum(starts + 2, len(arr) - 1)]
+    second = np.where(ends - starts >= 3, second, 0)
+
+    genotypes = np.empty(starts.shape + (2,), dtype=np.int8)
+    genotypes[:, :, 0] = (first == REF_BYTE)
+    genotypes[:, :, 0] += (second == REF_BYTE)
+    genotypes[:, :, 1] = (first == ALT_BYTE)
+    genotypes[:, :, 1] += (second == ALT_BYTE)
+
+    return VariantBlock(chromosomes, positions, ref_alleles, alt_alleles, genotypes)
+
+def parse_region(region):
+    """
+    Parses a region string of the form chrom, chrom:start, or
+    chrom:start-end into a (chrom, start, end) triplet.  Positions
+    are 1-based and inclusive.
+    """
+    chrom, sep, interval = region.rpartition(":")
+    if sep == "" or not interval.replace("-", "").replace(",", "").isdigit():
+        return (region, 1, sys.maxsize)
+
+    interval = interval.replace(",", "")
+    if "-" in interval:
+        start, end = interval.split("-", 1)
+        start = int(start) if start else 1
+        end = int(end) if end else sys.maxsize
+    else:
+        start = int(interval)
+        end = sys.maxsize
+
+    if start > end:
+        raise Exception("Invalid region '%s': start is after end" % region)
+
+    return (chrom, start, end)
+
+def merge_regions(regions):
+    """
+    Merges overlapping (chrom, start, end) regions on the same chromosome.
+    The merged regions of each chromosome are sorted by start position.
+    """
+    by_chrom = {}
+    for chrom, start, end in regions:
+        by_chrom.setdefault(chrom, []).append((start, end))
+
+    merged = []
+    for chrom, intervals in by_chrom.items():
+        intervals.sort()
+        cur_start, cur_end = intervals[0]
+        for start, end in intervals[1:]:
+            if start <= cur_end:
+                cur_end = max(cur_end, end)
+            else:
+                merged.append((chrom, cur_start, cur_end))
+                cur_start, cur_end = start, end
+        merged.append((chrom, cur_start, cur_end))
+
+    return merged
+
+def filter_region_lines(lines, regions):
+    """
+    Yields the variant lines falling in any of the given
+    (chrom, start, end) regions.
+    """
+    for ln in lines:
+        cols = ln.split(maxsplit=2)
+        chrom = cols[0].decode("utf-8")
+        pos = int(cols[1])
+        for region_chrom, start, end in regions:
+            if chrom == region_chrom and start <= pos <= end:
+                yield ln
+                break
+
+def filter_variant_lines(lines, variants):
+    """
+    Yields the variant lines whose (chrom, pos) pair is in the given
+    set of variants.
+    """
+    for ln in lines:
+        if ln.startswith(b"#"):
+            continue
+
+        cols = ln.split(maxsplit=2)
+        if (cols[0].decode("utf-8"), int(cols[1])) in variants:
+            yield ln
+
+class PrefetchingReader:
+    """
+    Reads the lines of a plain or gzipped file in a background thread.
+    The file is read (and decompressed) in large chunks, which are split
+    into batches of complete lines and handed to the consumer through a
+    bounded queue.  zlib and file reads release the GIL, so reading
+    overlaps with the parsing done by the consumer.
+    """
+    _DONE = object()
+
+    def __init__(self, flname, compressed, chunk_size=PREFETCH_CHUNK_SIZE, queue_size=PREFETCH_QUEUE_SIZE):
+        self.flname = flname
+        self.compressed = compressed
+        self.chunk_size = chunk_size
+        self.batches = queue.Queue(maxsize=queue_size)
+        self.stopped = threading.Event()
+
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    def _put(self, item):
+        # give up if the consumer stopped reading
+        while not self.stopped.is_set():
+            try:
+                self.batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def _read(self):
+        try:
+            with open(self.flname, "rb") as raw_fl:
+                fl = gzip.GzipFile(fileobj=raw_fl) if self.compressed else raw_fl
+
+                remainder = b""
+                while True:
+                    chunk = fl.read(self.chunk_size)
+                    if not chunk:
+                        break
+
+                    # hold back the incomplete last line
+                    chunk = remainder + chunk
+                    end = chunk.rfind(b"\n") + 1
+                    remainder = chunk[end:]
+                    if end > 0 and not self._put(io.BytesIO(chunk[:end]).readlines()):
+                        return
+
+                if remainder:
+                    self._put([remainder])
+            self._put(self._DONE)
+        except BaseException as e:
+            # the consumer would otherwise wait forever
+            self._put(e)
+
+    def close(self):
+        self.stopped.set()
+
+    def __iter__(self):
+        try:
+            while True:
+                batch = self.batches.get()
+                if batch is self._DONE:
+                    return
+                if isinstance(batch, BaseException):
+                    raise batch
+                yield from batch
+        finally:
+            self.close()
+
 class VCFStreamer:
-    def __init__(self, flname, compressed, kept_individuals=None):
+    """
+    Streams the variants of a VCF file.  If regions are given (as
+    region strings or (chrom, start, end) triplets), only the variants
+    in those regions are returned.  For BGZF compressed files, a block
+    index is used to seek directly to each region; other files are
+    scanned from start to end.  If a set of (chrom, pos) variants is
+    given, all other variants are skipped before their genotypes are
+    decoded.
+    """
+    def __init__(self, flname, compressed, kept_individuals=None, regions=None, variants=None):
         self.flname = flname
         if kept_individuals:
             self.kept_individuals = set(kept_individuals)
@@ -83,11 +335,11 @@ class VCFStreamer:
 
         self.stream = self.__open__()
         for ln in self.stream:
-            if ln.startswith("#CHROM"):
-                column_names = ln[1:].strip().split()
+            if ln.startswith(b"#CHROM"):
+                column_names = ln[1:].decode("utf-8").strip().split()
                 self.individual_names = column_names[len(DEFAULT_COLUMNS):]
                 break
-            if ln.startswith("#"):
+            if ln.startswith(b"#"):
                 continue
 
         self.kept_pairs = [(i, name) for i, name in enumerate(self.individual_names)
@@ -98,19 +350,80 @@ class VCFStreamer:
                               if self.kept_individuals is None \
                               or name in self.kept_individuals]
 
+        if regions:
+            regions = [parse_region(region) if isinstance(region, str) else region
+                       for region in regions]
+            if self.compressed and is_bgzf(self.flname):
+                self.stream.close()
+                self.stream = self.__open_regions__(regions)
+            else:
+                self.stream = filter_region_lines((ln for ln in self.stream
+                                                   if not ln.startswith(b"#")),
+                                                  regions)
+
+        if variants is not None:
+            self.stream = filter_variant_lines(self.stream, variants)
+
+    def __open_regions__(self, regions):
+        index = load_index(self.flname)
+        # fetch in file order so overlapping or out-of-order regions
+        # give the same variants as filtering the whole file
+        chrom_order = {}
+        for entry in index:
+            chrom_order.setdefault(entry.chrom, len(chrom_order))
+        regions = sorted(merge_regions(regions),
+                         key=lambda region: (chrom_order.get(region[0], len(chrom_order)),
+                                             region[1]))
+        for chrom, start, end in regions:
+            yield from fetch_region(self.flname, index, chrom, start, end)
+
     def __open__(self):
-        if self.compressed:
-            with gzip.open(self.flname, mode="rt", encoding="utf-8") as fl:
-                yield from fl
-        else:
-            with open(self.flname, "rt", encoding="utf-8") as fl:
-                yield from fl
+        return iter(PrefetchingReader(self.flname, self.compressed))
 
     def __iter__(self):
         for ln in self.stream:
-            if not ln.startswith("#"):
+            if not ln.startswith(b"#"):
                 self.positions_read += 1
-                yield parse_vcf_line(ln, self.kept_pairs)
+                yield parse_vcf_line(ln.decode("utf-8"), self.kept_pairs)
+
+    @property
+    def n_columns(self):
+        return GENOTYPE_OFFSET + len(self.individual_names)
+
+    @property
+    def kept_indices(self):
+        return [idx for idx, _ in self.kept_pairs]
+
+    def line_blocks(self, block_size=DEFAULT_BLOCK_SIZE):
+        """
+        Yields lists of up to block_size undecoded variant lines (as bytes).
+        """
+        lines = []
+        for ln in self.stream:
+            if ln.startswith(b"#") or not ln.strip():
+                continue
+
+            lines.append(ln)
+            if len(lines) == block_size:
+                self.positions_read += len(lines)
+                yield lines
+                lines = []
+
+        if len(lines) > 0:
+            self.positions_read += len(lines)
+            yield lines
+
+    def blocks(self, block_size=DEFAULT_BLOCK_SIZE):
+        """
+        Batched decoding mode.  Yields a VariantBlock for up to
+        block_size variants at a time, where genotypes is an int8
+        array of shape (n_variants, n_individuals, 2) of
+        (ref_count, alt_count) pairs.
+        """
+        n_columns = self.n_columns
+        kept_indices = self.kept_indices
+        for lines in self.line_blocks(block_size):
+            yield decode_genotype_block(lines, n_columns, kept_indices)
 
 ## Filters
 
@@ -139,6 +452,35 @@ def filter_invariants(min_percentage, stream):
         if fraction >= min_percentage:
             yield (label, alleles, genotypes)
 
+def select_variants(block, mask):
+    """
+    Returns a VariantBlock with only the variants selected by the
+    given boolean mask or index array.
+    """
+    return VariantBlock(*[field[mask] for field in block])
+
+def filter_invariant_blocks(min_percentage, blocks):
+    """
+    Block-oriented version of filter_invariants.  Variants are removed
+    from each VariantBlock using vectorized allele counts.
+
+    0 <= min_percentage < 1
+    """
+    for block in blocks:
+        allele_counts = block.genotypes.sum(axis=1, dtype=np.int64)
+        total_counts = allele_counts.sum(axis=1)
+        min_counts = allele_counts.min(axis=1)
+
+        # all SNPs have unknown genotypes
+        known = total_counts > 0
+        fractions = min_counts / np.maximum(total_counts, 1)
+
+        mask = known & (fractions >= min_percentage)
+        if mask.all():
+            yield block
+        elif mask.any():
+            yield select_variants(block, mask)
+
 class StreamCounter:
     def __init__(self, stream):
         self.count = 0
@@ -149,12 +491,16 @@ class StreamCounter:
             self.count += 1
             yield item
 
-def stream_vcf_variants(vcf_flname, compressed_vcf, allele_min_freq_threshold):
-    # dictionary of individual ids to population ids
-    stream = VCFStreamer(vcf_flname, compressed_vcf)
+def stream_vcf_variants(vcf_flname, compressed_vcf, allele_min_freq_threshold, kept_individuals=None, regions=None):
+    # genotypes of the other individuals are never decoded, so the
+    # allele frequency filter only considers the kept individuals
+    stream = VCFStreamer(vcf_flname,
+                         compressed_vcf,
+                         kept_individuals=kept_individuals,
+                         regions=regions)
 
     # remove SNPs with least-frequently occurring alleles less than a threshold
-    variants = filter_invariants(allele_min_freq_threshold,
-                                 stream)
+    variants = filter_invariant_blocks(allele_min_freq_threshold,
+                                       stream.blocks())
 
     return variants, stream.rows_to_names
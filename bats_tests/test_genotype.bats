@@ -51,3 +51,35 @@ load pca_setup_helper
 
     [ "$status" -eq 0 ]
 }
+
+@test "sweep parameters (kmeans)" {
+    run asaph_genotype \
+    	sweep-parameters \
+	--workdir ${FULL_WORKDIR_PATH} \
+	--components 1 2 \
+	--labels-fl ${POPS_PATH} \
+	kmeans \
+	--n-clusters 2 3
+
+    [ "$status" -eq 0 ]
+    [ -e "${FULL_WORKDIR_PATH}/sweep_results.tsv" ]
+
+    # header plus 3 component subsets x 2 scalings x 2 cluster counts
+    [ "$(wc -l < ${FULL_WORKDIR_PATH}/sweep_results.tsv)" -eq 13 ]
+}
+
+@test "sweep parameters (dbscan, parallel)" {
+    run asaph_genotype \
+    	sweep-parameters \
+	--workdir ${FULL_WORKDIR_PATH} \
+	--components 1 2 \
+	--labels-fl ${POPS_PATH} \
+	--jobs 2 \
+	--results-fl ${FULL_WORKDIR_PATH}/dbscan_sweep.tsv \
+	dbscan \
+	--eps-range 0.5 3.0 0.5 \
+	--min-samples-range 2 5 1
+
+    [ "$status" -eq 0 ]
+    [ -e "${FULL_WORKDIR_PATH}/dbscan_sweep.tsv" ]
+}
@@ -0,0 +1,175 @@
+#!/usr/bin/env bats
+
+load import_helper
+
+setup() {
+    N_INDIVIDUALS=20
+    N_SNPS=10000
+
+    export TEST_TEMP_DIR=`mktemp -u --tmpdir asaph-tests.XXXX`
+    mkdir -p ${TEST_TEMP_DIR}
+
+    export VCF_PATH="${TEST_TEMP_DIR}/test.vcf"
+    export POPS_PATH="${TEST_TEMP_DIR}/populations.txt"
+    export PHENO_PATH="${TEST_TEMP_DIR}/phenotypes.txt"
+    export WORKDIR_PATH="${TEST_TEMP_DIR}/workdir"
+    export STORE_PATH="${WORKDIR_PATH}/genotype_store"
+
+    asaph_generate_data \
+                        --seed 1234 \
+                        --n-populations 2 \
+                        --output-vcf ${VCF_PATH} \
+                        --output-populations ${POPS_PATH} \
+                        --individuals ${N_INDIVIDUALS} \
+                        --snps ${N_SNPS} \
+                        --n-phenotypes 3 \
+                        --output-phenotypes ${PHENO_PATH}
+
+    gzip -k ${VCF_PATH}
+}
+
+@test "Run asaph_import with no arguments" {
+    run asaph_import
+    [ "$status" -eq 2 ]
+}
+
+@test "Run asaph_import with --help option" {
+    run asaph_import --help
+    [ "$status" -eq 0 ]
+}
+
+@test "Import: vcf" {
+    run asaph_import \
+	--workdir ${WORKDIR_PATH} \
+	--vcf ${VCF_PATH}
+
+    [ "$status" -eq 0 ]
+    [ -d "${STORE_PATH}" ]
+    [ -e "${STORE_PATH}/header.json" ]
+    [ -e "${STORE_PATH}/genotypes.bin" ]
+    [ -e "${STORE_PATH}/maf.npy" ]
+}
+
+@test "Import: vcf.gz" {
+    run asaph_import \
+	--workdir ${WORKDIR_PATH} \
+	--vcf-gz ${VCF_PATH}.gz
+
+    [ "$status" -eq 0 ]
+    [ -e "${STORE_PATH}/header.json" ]
+}
+
+@test "PCA: genotype store matches vcf" {
+    run asaph_import \
+	--workdir ${WORKDIR_PATH} \
+	--vcf ${VCF_PATH}
+
+    [ "$status" -eq 0 ]
+
+    run asaph_pca \
+	--workdir ${WORKDIR_PATH} \
+	pca \
+	--genotype-store ${STORE_PATH} \
+	--sampling-method none
+
+    [ "$status" -eq 0 ]
+    [ -e "${WORKDIR_PATH}/pca_coordinates.tsv" ]
+    [ $(count_samples ${WORKDIR_PATH}) -eq ${N_INDIVIDUALS} ]
+
+    STORE_FEATURES=$(count_features ${WORKDIR_PATH})
+
+    # the store is not parsed, so multiple workers are rejected
+    run asaph_pca \
+	--workdir ${WORKDIR_PATH}/workers \
+	pca \
+	--genotype-store ${STORE_PATH} \
+	--workers 2
+
+    [ "$status" -ne 0 ]
+
+    run asaph_pca \
+	--workdir ${WORKDIR_PATH} \
+	pca \
+	--vcf ${VCF_PATH} \
+	--sampling-method none
+
+    [ "$status" -eq 0 ]
+    [ $(count_features ${WORKDIR_PATH}) -eq ${STORE_FEATURES} ]
+}
+
+@test "Association tests: genotype store" {
+    run asaph_import \
+	--workdir ${WORKDIR_PATH} \
+	--vcf ${VCF_PATH}
+
+    [ "$status" -eq 0 ]
+
+    run asaph_pca \
+	--workdir ${WORKDIR_PATH} \
+	pca \
+	--genotype-store ${STORE_PATH}
+
+    [ "$status" -eq 0 ]
+
+    run asaph_localize \
+	--workdir ${WORKDIR_PATH} \
+	association-tests \
+	--genotype-store ${STORE_PATH} \
+	--components 1 2
+
+    [ "$status" -eq 0 ]
+    [ -e "${WORKDIR_PATH}/pca_associations.tsv" ]
+
+    run asaph_pop_assoc_tests \
+	--genotype-store ${STORE_PATH} \
+	--population-fl ${POPS_PATH} \
+	--output-tsv ${TEST_TEMP_DIR}/pop_associations.tsv
+
+    [ "$status" -eq 0 ]
+    [ -e "${TEST_TEMP_DIR}/pop_associations.tsv" ]
+}
+
+@test "Prefetching reader: errors and early close" {
+    timeout 60 python3 - <<EOF
+import gzip
+
+from asaph.vcf import PrefetchingReader
+
+flname = "${VCF_PATH}"
+
+# errors opening the file are raised by the consumer
+try:
+    list(PrefetchingReader(flname + ".missing", False))
+    raise AssertionError("the reader error was not raised")
+except FileNotFoundError:
+    pass
+
+# a truncated gzip file fails part way through in the reader thread
+with open(flname, "rb") as fl:
+    data = gzip.compress(fl.read())
+with open(flname + ".gz", "wb") as fl:
+    fl.write(data[:len(data) // 2])
+
+reader = PrefetchingReader(flname + ".gz", True, chunk_size=4096, queue_size=1)
+n_lines = 0
+try:
+    for ln in reader:
+        n_lines += 1
+    raise AssertionError("the reader error was not raised")
+except EOFError:
+    pass
+assert n_lines > 0
+reader.thread.join(timeout=10)
+assert not reader.thread.is_alive()
+
+# stopping early frees the reader thread even when the queue is full
+reader = PrefetchingReader(flname, False, chunk_size=4096, queue_size=1)
+lines = iter(reader)
+next(lines)
+reader.thread.join(timeout=1)
+assert reader.thread.is_alive()
+lines.close()
+reader.thread.join(timeout=10)
+assert not reader.thread.is_alive()
+EOF
+}
@@ -79,3 +79,90 @@ load model_setup_helper
    [ "$status" -eq 0 ]
    [ -e "${COUNTS_WORKDIR_PATH}/plots/manhattan_pc2_chrom1.png" ]
 }
+
+@test "batch boundary detection and plots" {
+    run asaph_localize \
+	--workdir ${WORKDIR_PATH} \
+        association-tests \
+	--vcf ${VCF_PATH} \
+	--components 1 2
+
+    [ "$status" -eq 0 ]
+    [ -e "${WORKDIR_PATH}/pca_associations.npz" ]
+    # the temporary column files are removed
+    [ $(ls ${WORKDIR_PATH} | grep -c "pca_associations.npz.") -eq 0 ]
+
+    run asaph_localize \
+	--workdir ${WORKDIR_PATH} \
+	batch \
+	--n-windows 100 \
+	--manhattan-plots \
+	--window-size 1000 \
+	--jobs 2
+
+    [ "$status" -eq 0 ]
+    [ -e "${WORKDIR_PATH}/boundaries.tsv" ]
+    [ $(wc -l < ${WORKDIR_PATH}/boundaries.tsv) -eq 3 ]
+    [ -e "${WORKDIR_PATH}/plots/manhattan_pc1_chrom1.png" ]
+    [ -e "${WORKDIR_PATH}/plots/window_pc2_chrom1.png" ]
+}
+
+@test "detect boundaries with sliding windows at multiple resolutions" {
+    run asaph_localize \
+	--workdir ${WORKDIR_PATH} \
+        association-tests \
+	--vcf ${VCF_PATH} \
+	--components 1
+
+    [ "$status" -eq 0 ]
+
+    run asaph_localize \
+	--workdir ${WORKDIR_PATH} \
+	detect-boundaries \
+	--component 1 \
+	--chromosome 1 \
+	--n-windows 10 100 \
+	--window-overlap 4
+
+    [ "$status" -eq 0 ]
+    [[ "$output" == *"Left boundary"* ]]
+
+    # an overlap below 1 would give no windows
+    run asaph_localize \
+	--workdir ${WORKDIR_PATH} \
+	detect-boundaries \
+	--component 1 \
+	--chromosome 1 \
+	--window-overlap 0
+
+    [ "$status" -eq 2 ]
+}
+
+@test "association table sidecar matches the tsv file" {
+    mkdir -p ${WORKDIR_PATH}
+    python3 - <<EOF
+from importlib.machinery import SourceFileLoader
+import shutil
+
+import numpy as np
+import pandas as pd
+
+localize = SourceFileLoader("asaph_localize", shutil.which("asaph_localize")).load_module()
+
+# spans several chunks
+n_rows = 3 * localize.ASSOCIATIONS_CHUNK_SIZE + 17
+rng = np.random.default_rng(1234)
+pvalues = rng.uniform(size=n_rows)
+test_stream = ((i % 3 + 1, ("chr%d" % (i % 5), i), pvalue) for i, pvalue in enumerate(pvalues))
+localize.write_test_results("${WORKDIR_PATH}", test_stream)
+
+with open("${WORKDIR_PATH}/pca_associations.tsv") as fl:
+    expected = pd.read_csv(fl, sep="\t", float_precision="round_trip")
+with np.load("${WORKDIR_PATH}/pca_associations.npz") as arrays:
+    assert np.array_equal(arrays["components"], expected["component"])
+    assert np.array_equal(arrays["chromosome_names"][arrays["chromosomes"]], expected["chrom"])
+    assert np.array_equal(arrays["positions"], expected["pos"])
+    assert np.array_equal(arrays["pvalues"], expected["pvalue"])
+EOF
+    [ $(ls ${WORKDIR_PATH} | grep -c "pca_associations.npz.") -eq 0 ]
+}
@@ -48,7 +48,8 @@ setup() {
     [ "$status" -eq 0 ]
     [ -e "${WORKDIR_PATH}" ]
     [ -d "${WORKDIR_PATH}" ]
-    [ -e "${WORKDIR_PATH}/project_summary" ]
+    [ -e "${WORKDIR_PATH}/project_summary.json" ]
+    [ -e "${WORKDIR_PATH}/features.npy" ]
     [ -e "${WORKDIR_PATH}/pca_coordinates.tsv" ]
     [ -e "${WORKDIR_PATH}/models/model" ]
     [ $(count_samples ${WORKDIR_PATH}) -eq ${N_INDIVIDUALS} ]
@@ -64,7 +65,7 @@ setup() {
     [ "$status" -eq 0 ]
     [ -e "${WORKDIR_PATH}" ]
     [ -d "${WORKDIR_PATH}" ]
-    [ -e "${WORKDIR_PATH}/project_summary" ]
+    [ -e "${WORKDIR_PATH}/project_summary.json" ]
     [ -e "${WORKDIR_PATH}/models/model" ]
     [ -e "${WORKDIR_PATH}/pca_coordinates.tsv" ]
     [ $(count_samples ${WORKDIR_PATH}) -eq ${N_INDIVIDUALS} ]
@@ -80,7 +81,7 @@ setup() {
     [ "$status" -eq 0 ]
     [ -e "${WORKDIR_PATH}" ]
     [ -d "${WORKDIR_PATH}" ]
-    [ -e "${WORKDIR_PATH}/project_summary" ]
+    [ -e "${WORKDIR_PATH}/project_summary.json" ]
     [ -e "${WORKDIR_PATH}/models/model" ]
     [ -e "${WORKDIR_PATH}/pca_coordinates.tsv" ]
     [ $(count_samples ${WORKDIR_PATH}) -eq ${N_INDIVIDUALS} ]
@@ -97,7 +98,7 @@ setup() {
     [ "$status" -eq 0 ]
     [ -e "${WORKDIR_PATH}" ]
     [ -d "${WORKDIR_PATH}" ]
-    [ -e "${WORKDIR_PATH}/project_summary" ]
+    [ -e "${WORKDIR_PATH}/project_summary.json" ]
     [ -e "${WORKDIR_PATH}/models/model" ]
     [ -e "${WORKDIR_PATH}/pca_coordinates.tsv" ]
     [ $(count_samples ${WORKDIR_PATH}) -eq ${N_INDIVIDUALS} ]
@@ -113,7 +114,7 @@ setup() {
     [ "$status" -eq 0 ]
     [ -e "${WORKDIR_PATH}" ]
     [ -d "${WORKDIR_PATH}" ]
-    [ -e "${WORKDIR_PATH}/project_summary" ]
+    [ -e "${WORKDIR_PATH}/project_summary.json" ]
     [ -e "${WORKDIR_PATH}/models/model" ]
     [ -e "${WORKDIR_PATH}/pca_coordinates.tsv" ]
     [ $(count_samples ${WORKDIR_PATH}) -eq ${N_INDIVIDUALS} ]
@@ -129,12 +130,28 @@ setup() {
     [ "$status" -eq 0 ]
     [ -e "${WORKDIR_PATH}" ]
     [ -d "${WORKDIR_PATH}" ]
-    [ -e "${WORKDIR_PATH}/project_summary" ]
+    [ -e "${WORKDIR_PATH}/project_summary.json" ]
     [ -e "${WORKDIR_PATH}/models/model" ]
     [ -e "${WORKDIR_PATH}/pca_coordinates.tsv" ]
     [ $(count_samples ${WORKDIR_PATH}) -eq ${N_INDIVIDUALS} ]
 }
 
+@test "PCA: vcf, signed feature hashing" {
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH} \
+	pca \
+	--vcf ${VCF_PATH} \
+	--feature-type genotype-categories \
+	--sampling-method feature-hashing \
+	--signed-hashing \
+	--num-dimensions 100
+
+    [ "$status" -eq 0 ]
+    [ -e "${WORKDIR_PATH}/pca_coordinates.tsv" ]
+    [ -e "${WORKDIR_PATH}/feature_index.npz" ]
+    [ $(count_samples ${WORKDIR_PATH}) -eq ${N_INDIVIDUALS} ]
+}
+
 @test "PCA: vcf.gz, feature hashing, reduced by size" {
     run ${IMPORT_CMD} \
 	--workdir ${WORKDIR_PATH} \
@@ -147,7 +164,7 @@ setup() {
     [ "$status" -eq 0 ]
     [ -e "${WORKDIR_PATH}" ]
     [ -d "${WORKDIR_PATH}" ]
-    [ -e "${WORKDIR_PATH}/project_summary" ]
+    [ -e "${WORKDIR_PATH}/project_summary.json" ]
     [ -e "${WORKDIR_PATH}/models/model" ]
     [ -e "${WORKDIR_PATH}/pca_coordinates.tsv" ]
     [ $(count_samples ${WORKDIR_PATH}) -eq ${N_INDIVIDUALS} ]
@@ -165,7 +182,7 @@ setup() {
     [ "$status" -eq 0 ]
     [ -e "${WORKDIR_PATH}" ]
     [ -d "${WORKDIR_PATH}" ]
-    [ -e "${WORKDIR_PATH}/project_summary" ]
+    [ -e "${WORKDIR_PATH}/project_summary.json" ]
     [ -e "${WORKDIR_PATH}/models/model" ]
     [ -e "${WORKDIR_PATH}/pca_coordinates.tsv" ]
     [ $(count_features ${WORKDIR_PATH}) -eq 10 ]
@@ -186,7 +203,7 @@ setup() {
     [ "$status" -eq 0 ]
     [ -e "${WORKDIR_PATH}" ]
     [ -d "${WORKDIR_PATH}" ]
-    [ -e "${WORKDIR_PATH}/project_summary" ]
+    [ -e "${WORKDIR_PATH}/project_summary.json" ]
     [ -e "${WORKDIR_PATH}/models/model" ]
     [ -e "${WORKDIR_PATH}/pca_coordinates.tsv" ]
     [ $(count_samples ${WORKDIR_PATH}) -eq ${N_INDIVIDUALS} ]
@@ -204,9 +221,580 @@ setup() {
     [ "$status" -eq 0 ]
     [ -e "${WORKDIR_PATH}" ]
     [ -d "${WORKDIR_PATH}" ]
-    [ -e "${WORKDIR_PATH}/project_summary" ]
+    [ -e "${WORKDIR_PATH}/project_summary.json" ]
     [ -e "${WORKDIR_PATH}/models/model" ]
     [ -e "${WORKDIR_PATH}/pca_coordinates.tsv" ]
     [ $(count_features ${WORKDIR_PATH}) -eq 10 ]
     [ $(count_samples ${WORKDIR_PATH}) -eq ${N_INDIVIDUALS} ]
 }
+
+@test "PCA: vcf.gz, categories, multiple workers" {
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH} \
+	pca \
+	--vcf-gz ${VCF_PATH}.gz \
+	--feature-type genotype-categories \
+	--sampling-method none \
+	--workers 2
+
+    [ "$status" -eq 0 ]
+    [ -e "${WORKDIR_PATH}" ]
+    [ -d "${WORKDIR_PATH}" ]
+    [ -e "${WORKDIR_PATH}/project_summary.json" ]
+    [ -e "${WORKDIR_PATH}/models/model" ]
+    [ -e "${WORKDIR_PATH}/pca_coordinates.tsv" ]
+    [ $(count_features ${WORKDIR_PATH}) -eq $((N_SNPS * 3)) ]
+    [ $(count_samples ${WORKDIR_PATH}) -eq ${N_INDIVIDUALS} ]
+}
+
+@test "PCA: vcf.gz, categories, reservoir, multiple workers" {
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH} \
+	pca \
+	--vcf-gz ${VCF_PATH}.gz \
+	--feature-type genotype-categories \
+	--sampling-method reservoir \
+	--num-dimensions 10 \
+	--seed 1234 \
+	--workers 2
+
+    [ "$status" -eq 0 ]
+    [ -e "${WORKDIR_PATH}" ]
+    [ -d "${WORKDIR_PATH}" ]
+    [ -e "${WORKDIR_PATH}/project_summary.json" ]
+    [ -e "${WORKDIR_PATH}/models/model" ]
+    [ -e "${WORKDIR_PATH}/pca_coordinates.tsv" ]
+    [ $(count_features ${WORKDIR_PATH}) -eq 10 ]
+    [ $(count_samples ${WORKDIR_PATH}) -eq ${N_INDIVIDUALS} ]
+
+    # the same sample as a single-process import
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH}/serial \
+	pca \
+	--vcf-gz ${VCF_PATH}.gz \
+	--feature-type genotype-categories \
+	--sampling-method reservoir \
+	--num-dimensions 10 \
+	--seed 1234
+
+    [ "$status" -eq 0 ]
+    cmp ${WORKDIR_PATH}/features.npy ${WORKDIR_PATH}/serial/features.npy
+}
+
+@test "PCA: vcf.gz, counts, bottom-k, multiple workers" {
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH} \
+	pca \
+	--vcf-gz ${VCF_PATH}.gz \
+	--feature-type allele-counts \
+	--sampling-method bottom-k \
+	--num-dimensions 10 \
+	--workers 2
+
+    [ "$status" -eq 0 ]
+    [ -e "${WORKDIR_PATH}" ]
+    [ -d "${WORKDIR_PATH}" ]
+    [ -e "${WORKDIR_PATH}/project_summary.json" ]
+    [ -e "${WORKDIR_PATH}/models/model" ]
+    [ -e "${WORKDIR_PATH}/pca_coordinates.tsv" ]
+    [ $(count_features ${WORKDIR_PATH}) -eq 10 ]
+    [ $(count_samples ${WORKDIR_PATH}) -eq ${N_INDIVIDUALS} ]
+}
+
+@test "PCA: bgzipped vcf, counts, region" {
+    asaph_generate_data \
+                        --seed 1234 \
+                        --n-populations 2 \
+                        --output-vcf-gz ${TEST_TEMP_DIR}/bgzf.vcf.gz \
+                        --output-populations ${POPS_PATH} \
+                        --individuals ${N_INDIVIDUALS} \
+                        --snps ${N_SNPS} \
+                        --n-phenotypes 3 \
+                        --output-phenotypes ${PHENO_PATH}
+
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH} \
+	pca \
+	--vcf-gz ${TEST_TEMP_DIR}/bgzf.vcf.gz \
+	--feature-type allele-counts \
+	--sampling-method none \
+	--region 1:100-199
+
+    [ "$status" -eq 0 ]
+    [ -e "${WORKDIR_PATH}/project_summary.json" ]
+    [ -e "${WORKDIR_PATH}/pca_coordinates.tsv" ]
+    [ -e "${TEST_TEMP_DIR}/bgzf.vcf.gz.asaph_idx" ]
+    [ $(count_features ${WORKDIR_PATH}) -eq 200 ]
+    [ $(count_samples ${WORKDIR_PATH}) -eq ${N_INDIVIDUALS} ]
+}
+
+@test "PCA: bgzipped vcf, region, index cannot be saved" {
+    asaph_generate_data \
+                        --seed 1234 \
+                        --n-populations 2 \
+                        --output-vcf-gz ${TEST_TEMP_DIR}/bgzf.vcf.gz \
+                        --output-populations ${POPS_PATH} \
+                        --individuals ${N_INDIVIDUALS} \
+                        --snps ${N_SNPS} \
+                        --n-phenotypes 3 \
+                        --output-phenotypes ${PHENO_PATH}
+
+    # writing the index fails like it would in a read-only directory
+    ln -s ${TEST_TEMP_DIR}/missing/index ${TEST_TEMP_DIR}/bgzf.vcf.gz.asaph_idx
+
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH} \
+	pca \
+	--vcf-gz ${TEST_TEMP_DIR}/bgzf.vcf.gz \
+	--feature-type allele-counts \
+	--sampling-method none \
+	--region 1:100-199
+
+    [ "$status" -eq 0 ]
+    [[ "$output" == *"Could not save BGZF index"* ]]
+    [ $(count_features ${WORKDIR_PATH}) -eq 200 ]
+    [ $(count_samples ${WORKDIR_PATH}) -eq ${N_INDIVIDUALS} ]
+}
+
+@test "PCA: bgzipped vcf, counts, overlapping regions" {
+    asaph_generate_data \
+                        --seed 1234 \
+                        --n-populations 2 \
+                        --output-vcf-gz ${TEST_TEMP_DIR}/bgzf.vcf.gz \
+                        --output-populations ${POPS_PATH} \
+                        --individuals ${N_INDIVIDUALS} \
+                        --snps ${N_SNPS} \
+                        --n-phenotypes 3 \
+                        --output-phenotypes ${PHENO_PATH}
+
+    # overlapping and out of order, so the union is 1:100-249 and 1:5000-5049
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH}/bgzf \
+	pca \
+	--vcf-gz ${TEST_TEMP_DIR}/bgzf.vcf.gz \
+	--feature-type allele-counts \
+	--sampling-method none \
+	--region 1:5000-5049 \
+	--region 1:150-249 \
+	--region 1:100-199
+
+    [ "$status" -eq 0 ]
+    [ $(count_features ${WORKDIR_PATH}/bgzf) -eq 400 ]
+
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH}/plain \
+	pca \
+	--vcf ${VCF_PATH} \
+	--feature-type allele-counts \
+	--sampling-method none \
+	--region 1:5000-5049 \
+	--region 1:150-249 \
+	--region 1:100-199
+
+    [ "$status" -eq 0 ]
+    [ $(count_features ${WORKDIR_PATH}/plain) -eq 400 ]
+
+    cmp ${WORKDIR_PATH}/bgzf/pca_coordinates.tsv ${WORKDIR_PATH}/plain/pca_coordinates.tsv
+}
+
+@test "PCA: vcf, counts, multiple regions" {
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH} \
+	pca \
+	--vcf ${VCF_PATH} \
+	--feature-type allele-counts \
+	--sampling-method none \
+	--region 1:100-199 \
+	--region 1:5000-5049
+
+    [ "$status" -eq 0 ]
+    [ -e "${WORKDIR_PATH}/project_summary.json" ]
+    [ -e "${WORKDIR_PATH}/pca_coordinates.tsv" ]
+    [ $(count_features ${WORKDIR_PATH}) -eq 300 ]
+    [ $(count_samples ${WORKDIR_PATH}) -eq ${N_INDIVIDUALS} ]
+}
+
+@test "PCA: vcf, selected samples" {
+    SELECTED_PATH="${TEST_TEMP_DIR}/selected_samples.txt"
+    seq 0 9 > ${SELECTED_PATH}
+
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH} \
+	pca \
+	--vcf ${VCF_PATH} \
+	--selected-samples ${SELECTED_PATH} \
+	--sampling-method bottom-k \
+	--num-dimensions 100
+
+    [ "$status" -eq 0 ]
+    [ $(count_samples ${WORKDIR_PATH}) -eq 10 ]
+    [ $(wc -l < ${WORKDIR_PATH}/pca_coordinates.tsv) -eq 11 ]
+}
+
+@test "PCA: vcf, categories, incremental solver" {
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH} \
+	pca \
+	--vcf ${VCF_PATH} \
+	--feature-type genotype-categories \
+	--sampling-method none \
+	--pca-solver incremental
+
+    [ "$status" -eq 0 ]
+    [ -e "${WORKDIR_PATH}/project_summary.json" ]
+    [ -e "${WORKDIR_PATH}/pca_coordinates.tsv" ]
+    [ -e "${WORKDIR_PATH}/models/model" ]
+    [ ! -e "${WORKDIR_PATH}/features.npy" ]
+    [ $(count_features ${WORKDIR_PATH}) -eq $((N_SNPS * 3)) ]
+    [ $(count_samples ${WORKDIR_PATH}) -eq ${N_INDIVIDUALS} ]
+}
+
+@test "PCA: vcf, categories, randomized solver" {
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH} \
+	pca \
+	--vcf ${VCF_PATH} \
+	--feature-type genotype-categories \
+	--sampling-method none \
+	--pca-solver randomized
+
+    [ "$status" -eq 0 ]
+    [ -e "${WORKDIR_PATH}/pca_coordinates.tsv" ]
+    [ -e "${WORKDIR_PATH}/models/model" ]
+    [ $(count_features ${WORKDIR_PATH}) -eq $((N_SNPS * 3)) ]
+    [ $(count_samples ${WORKDIR_PATH}) -eq ${N_INDIVIDUALS} ]
+}
+
+@test "PCA: vcf, categories, sparse solver" {
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH} \
+	pca \
+	--vcf ${VCF_PATH} \
+	--feature-type genotype-categories \
+	--sampling-method none \
+	--pca-solver sparse \
+	--n-components 4
+
+    [ "$status" -eq 0 ]
+    [ -e "${WORKDIR_PATH}/features.npz" ]
+    [ ! -e "${WORKDIR_PATH}/features.npy" ]
+    [ -e "${WORKDIR_PATH}/pca_coordinates.tsv" ]
+    [ $(count_features ${WORKDIR_PATH}) -eq $((N_SNPS * 3)) ]
+    [ $(count_samples ${WORKDIR_PATH}) -eq ${N_INDIVIDUALS} ]
+
+    NEW_VCF_PATH="${TEST_TEMP_DIR}/new_samples.vcf"
+    sed '/^#CHROM/ s/\t\([^\t]*\)/\tnew_\1/9g' ${VCF_PATH} > ${NEW_VCF_PATH}
+
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH} \
+	project \
+	--vcf ${NEW_VCF_PATH}
+
+    [ "$status" -eq 0 ]
+    [ $(wc -l < ${WORKDIR_PATH}/pca_coordinates.tsv) -eq $((2 * N_INDIVIDUALS + 1)) ]
+}
+
+@test "PCA: refit in a workdir removes stale files" {
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH} \
+	pca \
+	--vcf ${VCF_PATH} \
+	--feature-type genotype-categories \
+	--sampling-method none \
+	--pca-solver sparse \
+	--n-components 4
+
+    [ "$status" -eq 0 ]
+    [ -e "${WORKDIR_PATH}/features.npz" ]
+    [ -e "${WORKDIR_PATH}/feature_index.npz" ]
+
+    # the gram solver does not keep the feature matrix
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH} \
+	pca \
+	--vcf ${VCF_PATH} \
+	--feature-type allele-counts \
+	--sampling-method none \
+	--pca-solver gram
+
+    [ "$status" -eq 0 ]
+    [ -e "${WORKDIR_PATH}/gram.npz" ]
+    [ ! -e "${WORKDIR_PATH}/features.npz" ]
+    [ ! -e "${WORKDIR_PATH}/feature_index.npz" ]
+
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH} \
+	pca \
+	--vcf ${VCF_PATH} \
+	--feature-type allele-counts \
+	--sampling-method bottom-k \
+	--num-dimensions 100
+
+    [ "$status" -eq 0 ]
+    [ ! -e "${WORKDIR_PATH}/gram.npz" ]
+    [ -e "${WORKDIR_PATH}/features.npy" ]
+    [ -e "${WORKDIR_PATH}/feature_index.npz" ]
+
+    run python3 -c "from asaph.newioutils import read_features; print(read_features('${WORKDIR_PATH}').shape)"
+    [ "$output" = "(${N_INDIVIDUALS}, 100)" ]
+
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH} \
+	pca \
+	--vcf ${VCF_PATH} \
+	--feature-type genotype-categories \
+	--sampling-method none \
+	--pca-solver sparse \
+	--n-components 4
+
+    [ "$status" -eq 0 ]
+    [ -e "${WORKDIR_PATH}/features.npz" ]
+    [ ! -e "${WORKDIR_PATH}/features.npy" ]
+}
+
+@test "PCA: vcf, counts, bottom-k, randomized solver" {
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH} \
+	pca \
+	--vcf ${VCF_PATH} \
+	--feature-type allele-counts \
+	--sampling-method bottom-k \
+	--num-dimensions 100 \
+	--pca-solver randomized
+
+    [ "$status" -eq 0 ]
+    [ -e "${WORKDIR_PATH}/features.npy" ]
+    [ -e "${WORKDIR_PATH}/pca_coordinates.tsv" ]
+    [ $(count_features ${WORKDIR_PATH}) -eq 100 ]
+    [ $(count_samples ${WORKDIR_PATH}) -eq ${N_INDIVIDUALS} ]
+}
+
+@test "PCA: project new samples" {
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH} \
+	pca \
+	--vcf ${VCF_PATH} \
+	--feature-type allele-counts \
+	--sampling-method bottom-k \
+	--num-dimensions 100
+
+    [ "$status" -eq 0 ]
+    [ -e "${WORKDIR_PATH}/feature_index.npz" ]
+
+    # same genotypes under new sample names
+    NEW_VCF_PATH="${TEST_TEMP_DIR}/new_samples.vcf"
+    sed '/^#CHROM/ s/\t\([^\t]*\)/\tnew_\1/9g' ${VCF_PATH} > ${NEW_VCF_PATH}
+
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH} \
+	project \
+	--vcf ${NEW_VCF_PATH}
+
+    [ "$status" -eq 0 ]
+    [ $(wc -l < ${WORKDIR_PATH}/pca_coordinates.tsv) -eq $((2 * N_INDIVIDUALS + 1)) ]
+
+    # samples cannot be added twice
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH} \
+	project \
+	--vcf ${NEW_VCF_PATH}
+
+    [ "$status" -ne 0 ]
+}
+
+@test "PCA: project new samples, feature hashing" {
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH} \
+	pca \
+	--vcf ${VCF_PATH} \
+	--feature-type allele-counts \
+	--sampling-method feature-hashing \
+	--num-dimensions 64
+
+    [ "$status" -eq 0 ]
+
+    # only the buckets and seed are stored, not a hash per feature
+    run python3 -c "import numpy as np; print(sorted(np.load('${WORKDIR_PATH}/feature_index.npz').files))"
+    [ "$output" = "['buckets', 'hash_seed', 'n_buckets', 'signed_hashing']" ]
+
+    # same genotypes under new sample names
+    NEW_VCF_PATH="${TEST_TEMP_DIR}/new_samples.vcf"
+    sed '/^#CHROM/ s/\t\([^\t]*\)/\tnew_\1/9g' ${VCF_PATH} > ${NEW_VCF_PATH}
+
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH} \
+	project \
+	--vcf ${NEW_VCF_PATH}
+
+    [ "$status" -eq 0 ]
+
+    # the new samples are placed on top of the original ones
+    ORIGINAL=$(sed -n "2,$((N_INDIVIDUALS + 1))p" ${WORKDIR_PATH}/pca_coordinates.tsv | cut -f 2- | awk '{ for (i = 1; i <= NF; i++) printf "%.6f ", $i; print "" }')
+    PROJECTED=$(sed -n "$((N_INDIVIDUALS + 2)),\$p" ${WORKDIR_PATH}/pca_coordinates.tsv | cut -f 2- | awk '{ for (i = 1; i <= NF; i++) printf "%.6f ", $i; print "" }')
+    [ "$ORIGINAL" = "$PROJECTED" ]
+}
+
+@test "PCA: reservoir seed and feature index reuse" {
+    for run_dir in first second; do
+	run ${IMPORT_CMD} \
+	    --workdir ${WORKDIR_PATH}/${run_dir} \
+	    pca \
+	    --vcf ${VCF_PATH} \
+	    --feature-type genotype-categories \
+	    --sampling-method reservoir \
+	    --num-dimensions 100 \
+	    --seed 1234
+
+	[ "$status" -eq 0 ]
+    done
+
+    cmp ${WORKDIR_PATH}/first/pca_coordinates.tsv ${WORKDIR_PATH}/second/pca_coordinates.tsv
+
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH}/reused \
+	pca \
+	--vcf ${VCF_PATH} \
+	--feature-index ${WORKDIR_PATH}/first
+
+    [ "$status" -eq 0 ]
+    cmp ${WORKDIR_PATH}/first/features.npy ${WORKDIR_PATH}/reused/features.npy
+}
+
+@test "Reservoir sampling: size and uniformity, single and merged streams" {
+    python3 - <<EOF
+import numpy as np
+from scipy.stats import chi2
+
+from asaph.feature_matrix_construction import ReservoirMatrixAccumulator
+from asaph.models import FeatureBlock
+
+N_POSITIONS = 1000
+N_KEPT = 50
+N_TRIALS = 2000
+BLOCK_SIZE = 64
+
+def stream(accumulator, start, end):
+    for block_start in range(start, end, BLOCK_SIZE):
+        positions = np.arange(block_start, min(block_start + BLOCK_SIZE, end))
+        labels = [("1", int(pos), "0") for pos in positions]
+        accumulator.update(FeatureBlock(labels, positions[np.newaxis, :]))
+    return accumulator
+
+def check(make_reservoir):
+    counts = np.zeros(N_POSITIONS)
+    for trial in range(N_TRIALS):
+        accumulator = make_reservoir(trial)
+        kept = accumulator.result()[0]
+        feature_index = accumulator.feature_index()
+
+        assert kept.shape == (N_KEPT,)
+        assert len(np.unique(kept)) == N_KEPT
+        assert np.array_equal(feature_index.positions, kept)
+        counts[kept] += 1
+
+    # each position is kept N_KEPT / N_POSITIONS of the time
+    expected = N_TRIALS * N_KEPT / N_POSITIONS
+    statistic = ((counts - expected) ** 2 / expected).sum()
+    pvalue = chi2.sf(statistic, N_POSITIONS - 1)
+    assert pvalue > 0.001, pvalue
+
+    # and no part of the stream is favored
+    for part in np.array_split(counts, 10):
+        assert abs(part.mean() / expected - 1.0) < 0.05, part.mean()
+
+check(lambda seed: stream(ReservoirMatrixAccumulator(N_KEPT, random_seed=seed), 0, N_POSITIONS))
+
+def merged(seed):
+    first = stream(ReservoirMatrixAccumulator(N_KEPT, random_seed=2 * seed), 0, 300)
+    second = stream(ReservoirMatrixAccumulator(N_KEPT, random_seed=2 * seed + 1), 300, N_POSITIONS)
+    first.merge(second)
+    assert first.n_seen == N_POSITIONS
+    return first
+
+check(merged)
+EOF
+}
+
+@test "PCA: merge bottom-k sketches" {
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH}/whole \
+	pca \
+	--vcf ${VCF_PATH} \
+	--sampling-method bottom-k \
+	--num-dimensions 100
+
+    [ "$status" -eq 0 ]
+
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH}/first \
+	pca \
+	--vcf ${VCF_PATH} \
+	--sampling-method bottom-k \
+	--num-dimensions 100 \
+	--region 1:1-5000
+
+    [ "$status" -eq 0 ]
+
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH}/second \
+	pca \
+	--vcf ${VCF_PATH} \
+	--sampling-method bottom-k \
+	--num-dimensions 100 \
+	--region 1:5001-10000
+
+    [ "$status" -eq 0 ]
+
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH}/merged \
+	merge-sketches \
+	--projects ${WORKDIR_PATH}/first ${WORKDIR_PATH}/second
+
+    [ "$status" -eq 0 ]
+    [ -e "${WORKDIR_PATH}/merged/pca_coordinates.tsv" ]
+
+    # same features as sketching all of the variants at once
+    cmp ${WORKDIR_PATH}/whole/features.npy ${WORKDIR_PATH}/merged/features.npy
+}
+
+@test "PCA: merge gram matrices" {
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH}/whole \
+	pca \
+	--vcf ${VCF_PATH} \
+	--sampling-method none \
+	--pca-solver gram
+
+    [ "$status" -eq 0 ]
+    [ -e "${WORKDIR_PATH}/whole/gram.npz" ]
+
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH}/first \
+	pca \
+	--vcf ${VCF_PATH} \
+	--sampling-method none \
+	--pca-solver gram \
+	--region 1:0-4999
+
+    [ "$status" -eq 0 ]
+
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH}/second \
+	pca \
+	--vcf ${VCF_PATH} \
+	--sampling-method none \
+	--pca-solver gram \
+	--region 1:5000-9999
+
+    [ "$status" -eq 0 ]
+
+    run ${IMPORT_CMD} \
+	--workdir ${WORKDIR_PATH}/merged \
+	merge-gram \
+	--projects ${WORKDIR_PATH}/second ${WORKDIR_PATH}/first
+
+    [ "$status" -eq 0 ]
+    [ -e "${WORKDIR_PATH}/merged/pca_coordinates.tsv" ]
+    [ ! -e "${WORKDIR_PATH}/merged/features.npy" ]
+    [ $(count_features ${WORKDIR_PATH}/merged) -eq $(count_features ${WORKDIR_PATH}/whole) ]
+}
@@ -0,0 +1,201 @@
+#!/usr/bin/env bats
+
+setup() {
+    N_INDIVIDUALS=20
+    N_SNPS=1000
+
+    export TEST_TEMP_DIR=`mktemp -u --tmpdir asaph-tests.XXXX`
+    mkdir -p ${TEST_TEMP_DIR}
+
+    export VCF_PATH="${TEST_TEMP_DIR}/test.vcf"
+    export POPS_PATH="${TEST_TEMP_DIR}/populations.txt"
+    export PHENO_PATH="${TEST_TEMP_DIR}/phenotypes.txt"
+
+    asaph_generate_data \
+                        --seed 1234 \
+                        --n-populations 2 \
+                        --output-vcf ${VCF_PATH} \
+                        --output-populations ${POPS_PATH} \
+                        --individuals ${N_INDIVIDUALS} \
+                        --snps ${N_SNPS} \
+                        --n-phenotypes 2 \
+                        --output-phenotypes ${PHENO_PATH}
+}
+
+@test "Run asaph_phenotype_assoc_tests with no arguments" {
+    run asaph_phenotype_assoc_tests
+    [ "$status" -eq 2 ]
+}
+
+@test "Run asaph_phenotype_assoc_tests with --help option" {
+    run asaph_phenotype_assoc_tests --help
+    [ "$status" -eq 0 ]
+}
+
+@test "Phenotype association tests: exact solver" {
+    run asaph_phenotype_assoc_tests \
+	--vcf ${VCF_PATH} \
+	--phenotypes-fl ${PHENO_PATH} \
+	--solver exact \
+	--output-tsv ${TEST_TEMP_DIR}/associations.tsv
+
+    [ "$status" -eq 0 ]
+    [ -e "${TEST_TEMP_DIR}/associations.tsv" ]
+    [ $(wc -l < ${TEST_TEMP_DIR}/associations.tsv) -eq $((N_SNPS + 1)) ]
+}
+
+@test "Phenotype association tests: sgd solver" {
+    run asaph_phenotype_assoc_tests \
+	--vcf ${VCF_PATH} \
+	--phenotypes-fl ${PHENO_PATH} \
+	--solver sgd \
+	--region 1:0-49 \
+	--output-tsv ${TEST_TEMP_DIR}/associations.tsv
+
+    [ "$status" -eq 0 ]
+    [ $(wc -l < ${TEST_TEMP_DIR}/associations.tsv) -eq 51 ]
+}
+
+@test "Phenotype association tests: exact solver matches lstsq" {
+    python3 - <<EOF
+import numpy as np
+from scipy.stats import chi2
+
+from asaph.ml import EXACT_SOLVER
+from asaph.ml import snp_linreg_pvalues
+from asaph.ml import upsample_features
+
+rng = np.random.default_rng(1234)
+for n_unknown in [0, 5]:
+    X = np.eye(3)[rng.integers(3, size=40)]
+    X[:n_unknown] = 0.0
+    y = rng.normal(size=40) + X @ np.array([0.0, 0.5, 1.0])
+
+    # least squares on the expanded, weighted samples
+    adj_y, adj_X, weights = upsample_features(y, X, weighted=True)
+    sqrt_w = np.sqrt(weights)
+    coef, _, _, _ = np.linalg.lstsq(adj_X * sqrt_w[:, np.newaxis], adj_y * sqrt_w, rcond=None)
+
+    alt_error2 = np.dot(weights, (adj_y - adj_X @ coef) ** 2)
+    null_error2 = np.dot(y - y.mean(), y - y.mean())
+    G = (null_error2 - alt_error2) / (null_error2 / (len(y) - 1))
+    expected = chi2.sf(G, 2)
+
+    pvalue, _, _, gt_pred_ys = snp_linreg_pvalues(X, y, solver=EXACT_SOLVER)
+    assert np.isclose(pvalue, expected, rtol=1e-8), (pvalue, expected)
+    assert np.allclose(gt_pred_ys, coef)
+EOF
+}
+
+@test "Phenotype association tests: sgd solver, weighted samples" {
+    run asaph_phenotype_assoc_tests \
+	--vcf ${VCF_PATH} \
+	--phenotypes-fl ${PHENO_PATH} \
+	--solver sgd \
+	--weighted \
+	--region 1:0-49 \
+	--output-tsv ${TEST_TEMP_DIR}/associations.tsv
+
+    [ "$status" -eq 0 ]
+    [ $(wc -l < ${TEST_TEMP_DIR}/associations.tsv) -eq 51 ]
+}
+
+@test "Phenotype association tests: logistic model" {
+    run asaph_phenotype_assoc_tests \
+	--vcf ${VCF_PATH} \
+	--phenotypes-fl ${PHENO_PATH} \
+	--model logistic \
+	--solver exact \
+	--output-tsv ${TEST_TEMP_DIR}/associations.tsv
+
+    [ "$status" -eq 0 ]
+    [ $(wc -l < ${TEST_TEMP_DIR}/associations.tsv) -eq $((N_SNPS + 1)) ]
+
+    run asaph_phenotype_assoc_tests \
+	--vcf ${VCF_PATH} \
+	--phenotypes-fl ${PHENO_PATH} \
+	--model logistic \
+	--solver sgd \
+	--region 1:0-9 \
+	--output-tsv ${TEST_TEMP_DIR}/associations.tsv
+
+    [ "$status" -eq 0 ]
+    [ $(wc -l < ${TEST_TEMP_DIR}/associations.tsv) -eq 11 ]
+
+    run asaph_phenotype_assoc_tests \
+	--vcf ${VCF_PATH} \
+	--phenotypes-fl ${PHENO_PATH} \
+	--model logistic \
+	--weighted \
+	--output-tsv ${TEST_TEMP_DIR}/associations.tsv
+
+    [ "$status" -eq 2 ]
+    [[ "$output" == *"--weighted is only supported with --model linear"* ]]
+}
+
+@test "Phenotype association tests: weighted samples match weighted lstsq" {
+    python3 - <<EOF
+import numpy as np
+from scipy.stats import chi2
+
+from asaph.ml import EXACT_SOLVER
+from asaph.ml import SGD_SOLVER
+from asaph.ml import snp_linreg_pvalues
+from asaph.ml import upsample_features
+
+rng = np.random.default_rng(1234)
+X = np.eye(3)[rng.integers(3, size=40)]
+X[:5] = 0.0
+y = rng.normal(size=40) + X @ np.array([0.0, 0.5, 1.0])
+
+adj_y, adj_X, weights = upsample_features(y, X, weighted=True)
+assert np.isclose(weights.sum(), len(y))
+
+sqrt_w = np.sqrt(weights)
+coef, _, _, _ = np.linalg.lstsq(adj_X * sqrt_w[:, np.newaxis], adj_y * sqrt_w, rcond=None)
+alt_error2 = np.dot(weights, (adj_y - adj_X @ coef) ** 2)
+null_error2 = np.dot(y - y.mean(), y - y.mean())
+expected = chi2.sf((null_error2 - alt_error2) / (null_error2 / (len(y) - 1)), 2)
+
+# the genotypes are one-hot, so the predictions are the coefficients
+pvalue, _, _, gt_pred_ys = snp_linreg_pvalues(X, y, solver=EXACT_SOLVER)
+assert np.isclose(pvalue, expected, rtol=1e-8), (pvalue, expected)
+assert np.allclose(gt_pred_ys, coef)
+
+# SGD is regularized and stochastic, so only check that it is close
+np.random.seed(1234)
+pvalue, _, _, _ = snp_linreg_pvalues(X, y, solver=SGD_SOLVER, weighted=True)
+assert abs(np.log10(pvalue) - np.log10(expected)) < 1.0, (pvalue, expected)
+EOF
+}
+
+@test "Phenotype association tests: IRLS matches unpenalized logistic regression" {
+    python3 - <<EOF
+import numpy as np
+from scipy.stats import chi2
+from sklearn.linear_model import LogisticRegression
+
+from asaph.ml import EXACT_SOLVER
+from asaph.ml import likelihood_ratio_test
+from asaph.ml import upsample_features
+
+def log_likelihood(y, prob):
+    return np.sum(y * np.log(prob) + (1.0 - y) * np.log(1.0 - prob))
+
+rng = np.random.default_rng(1234)
+for n_unknown in [0, 5]:
+    X = np.eye(3)[rng.integers(3, size=40)]
+    X[:n_unknown] = 0.0
+    labels = (rng.uniform(size=40) < 0.3 + 0.2 * X.argmax(axis=1)).astype(np.float64)
+    adj_y, adj_X = upsample_features(labels, X)
+
+    lr = LogisticRegression(C=np.inf, tol=1e-10, max_iter=10000).fit(adj_X, adj_y)
+    alt_prob = lr.predict_proba(adj_X)[:, 1]
+    null_prob = np.full(len(adj_y), adj_y.mean())
+    G = 2.0 * (log_likelihood(adj_y, alt_prob) - log_likelihood(adj_y, null_prob)) / 3.0
+    expected = chi2.sf(G, 3)
+
+    pvalue = likelihood_ratio_test(adj_X, adj_y, None, g_scaling_factor=1.0 / 3.0, solver=EXACT_SOLVER)
+    assert np.isclose(pvalue, expected, rtol=1e-6), (pvalue, expected)
+EOF
+}
@@ -0,0 +1,93 @@
+#!/usr/bin/env bats
+
+setup() {
+    N_INDIVIDUALS=20
+    N_SNPS=10000
+
+    export TEST_TEMP_DIR=`mktemp -u --tmpdir asaph-tests.XXXX`
+    mkdir -p ${TEST_TEMP_DIR}
+
+    export VCF_PATH="${TEST_TEMP_DIR}/test.vcf"
+    export POPS_PATH="${TEST_TEMP_DIR}/populations.txt"
+    export PHENO_PATH="${TEST_TEMP_DIR}/phenotypes.txt"
+    export LABELS_PATH="${TEST_TEMP_DIR}/labels.txt"
+
+    asaph_generate_data \
+                        --seed 1234 \
+                        --n-populations 2 \
+                        --output-vcf ${VCF_PATH} \
+                        --output-populations ${POPS_PATH} \
+                        --individuals ${N_INDIVIDUALS} \
+                        --snps ${N_SNPS} \
+                        --n-phenotypes 3 \
+                        --output-phenotypes ${PHENO_PATH}
+
+    # label the samples by their genotype at the first variant
+    awk -F'\t' '$1 == "1" && $2 == "0" {
+        het = "het"; hom = "hom"
+        for (i = 10; i <= NF; i++) {
+            if ($i == "0/1" || $i == "1/0") het = het "," (i - 10); else hom = hom "," (i - 10)
+        }
+        print het; print hom
+    }' ${VCF_PATH} > ${LABELS_PATH}
+}
+
+@test "Run asaph_supervised_genotyping with no arguments" {
+    run asaph_supervised_genotyping
+    [ "$status" -eq 2 ]
+}
+
+@test "Run asaph_supervised_genotyping with --help option" {
+    run asaph_supervised_genotyping --help
+    [ "$status" -eq 0 ]
+}
+
+@test "Cross-fold validation: folds match with one or two jobs" {
+    for jobs in 1 2; do
+	run asaph_supervised_genotyping \
+	    --vcf ${VCF_PATH} \
+	    crossfold-validation \
+	    --labels-fl ${LABELS_PATH} \
+	    --sampling-method reservoir \
+	    --num-dimensions 2000 \
+	    --sig-threshold 0.05 \
+	    --seed 1234 \
+	    --jobs ${jobs}
+
+	[ "$status" -eq 0 ]
+	echo "$output" | sed -n '/^Fold/,$p' > ${TEST_TEMP_DIR}/results_${jobs}.txt
+    done
+
+    [ $(grep -c "^Fold" ${TEST_TEMP_DIR}/results_1.txt) -eq 5 ]
+    cmp ${TEST_TEMP_DIR}/results_1.txt ${TEST_TEMP_DIR}/results_2.txt
+}
+
+@test "Feature ANOVA matches f_oneway" {
+    python3 - <<EOF
+import numpy as np
+from scipy.stats import f_oneway
+
+from asaph.ml import feature_anova_pvalues
+
+rng = np.random.default_rng(1234)
+labels = np.repeat(np.arange(3), 9)
+
+# each group holds the same values, so the group means are equal
+equal_means = rng.integers(0, 3, size=(9, 500))
+equal_means = np.vstack([rng.permuted(equal_means, axis=0) for _ in range(3)])
+features = np.hstack([rng.integers(0, 3, size=(len(labels), 500)), equal_means]).astype(np.uint8)
+
+pvalues = feature_anova_pvalues(features, labels)
+
+groups = [features[labels == label].astype(np.float64) for label in range(3)]
+constant = np.all([np.all(group == group[0], axis=0) for group in groups], axis=0)
+expected = np.array([f_oneway(*[group[:, i] for group in groups]).pvalue
+                     for i in range(features.shape[1])])
+
+assert np.array_equal(np.isnan(pvalues), constant)
+# f_oneway gets NaN or about 1 from the roundoff when the means are equal
+tested = ~constant & ~np.isnan(expected)
+assert np.allclose(pvalues[tested], expected[tested])
+assert np.allclose(pvalues[500:][~constant[500:]], 1.0)
+EOF
+}
@@ -27,4 +27,5 @@ setup(name="asaph",
       python_requires=">=3.7",
       install_requires = ["numpy>=0.19.1", "scipy>=0.19.1", "matplotlib", "seaborn", "scikit-learn", "joblib", "pandas", "mmh3"],
       scripts=["bin/asaph_pca", "bin/asaph_query",
-               "bin/asaph_localize", "bin/asaph_genotype", "bin/asaph_generate_data"])
+               "bin/asaph_localize", "bin/asaph_genotype", "bin/asaph_generate_data",
+               "bin/asaph_import", "bin/asaph_phenotype_assoc_tests"])